@@ -1,4 +1,7 @@
 # flake8: noqa
 from .servers import *
+from .assets import *
+from .lint import *
+from .reports import *
 from .local import *
 from .remote import *
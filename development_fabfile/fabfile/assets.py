@@ -0,0 +1,181 @@
+"""Fab tasks that compile static assets on the local machine."""
+import os
+import re
+import time
+
+from django.conf import settings
+
+from fabric.api import local
+from fabric.colors import green, red
+from fabric.utils import puts, warn
+
+from .utils import run_parallel
+
+
+ASSET_COMPILERS = {
+    '.less': 'lessc {source} {target}',
+    '.scss': 'sassc {source} {target}',
+    '.js': 'browserify {source} -o {target}',
+}
+
+IMPORT_PATTERNS = {
+    '.less': re.compile(
+        r'@import\s*(?:\([^)]*\)\s*)?(?:url\()?["\']([^"\']+)["\']'),
+    '.scss': re.compile(r'@(?:import|use|forward)\s+([^;]+);'),
+    '.js': re.compile(
+        r'(?:require\(\s*|import\s*\(\s*|from\s+|import\s+)'
+        r'["\'](\.{1,2}/[^"\']+)["\']'),
+}
+
+# Caches the imports of every parsed file as ``{path: (mtime, imports)}``
+_IMPORTS_CACHE = {}
+
+
+def _get_candidates(path, extension):
+    """Returns the files an import of ``path`` could refer to."""
+    directory, name = os.path.split(path)
+    candidates = [path]
+    if not path.endswith(extension):
+        candidates.append(path + extension)
+    if extension == '.scss':
+        candidates += [
+            os.path.join(directory, '_' + name),
+            os.path.join(directory, '_' + name + extension),
+            os.path.join(path, '_index' + extension),
+        ]
+    elif extension == '.js':
+        candidates.append(os.path.join(path, 'index.js'))
+    return candidates
+
+
+def _get_imports(path):
+    """Returns the resolved paths of all files imported by the given file."""
+    extension = os.path.splitext(path)[1]
+    if extension not in IMPORT_PATTERNS:
+        # Other files, e.g. css imported by less or js, have no dependencies
+        return []
+    mtime = os.path.getmtime(path)
+    cached = _IMPORTS_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path) as asset_file:
+        content = asset_file.read()
+    names = []
+    for match in IMPORT_PATTERNS[extension].finditer(content):
+        if extension == '.scss':
+            names += re.findall(r'["\']([^"\']+)["\']', match.group(1))
+        else:
+            names.append(match.group(1))
+    imports = []
+    for name in names:
+        candidates = _get_candidates(
+            os.path.normpath(os.path.join(os.path.dirname(path), name)),
+            extension)
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                imports.append(candidate)
+                break
+    _IMPORTS_CACHE[path] = (mtime, imports)
+    return imports
+
+
+def _get_dependencies(source):
+    """
+    Returns the given entry point and all files it imports recursively.
+
+    :param source: Path to a less, scss or js entry point.
+
+    """
+    dependencies = set()
+    pending = [os.path.normpath(source)]
+    while pending:
+        path = pending.pop()
+        if path in dependencies or not os.path.isfile(path):
+            continue
+        dependencies.add(path)
+        pending += _get_imports(path)
+    return dependencies
+
+
+def _get_stale_assets(force=False):
+    """Returns ``(source, target)`` tuples that need to be rebuilt."""
+    stale = []
+    for target, source in sorted(settings.ASSET_ENTRY_POINTS.items()):
+        if not force and os.path.exists(target):
+            target_mtime = os.path.getmtime(target)
+            if all(os.path.getmtime(path) <= target_mtime
+                   for path in _get_dependencies(source)):
+                continue
+        stale.append((source, target))
+    return stale
+
+
+def _get_mtimes(source):
+    """Returns the modification times of the entry point and its imports."""
+    return sorted((path, os.path.getmtime(path))
+                  for path in _get_dependencies(source))
+
+
+def _build_asset(asset):
+    """Compiles one entry point."""
+    source, target = asset
+    compilers = getattr(settings, 'ASSET_COMPILERS', ASSET_COMPILERS)
+    command = compilers[os.path.splitext(source)[1]]
+    local(command.format(source=source, target=target))
+    return target
+
+
+def _try_build_asset(asset):
+    """
+    Compiles one entry point without aborting if the compiler fails.
+
+    :returns: The target or ``None`` if the build failed.
+
+    """
+    try:
+        return _build_asset(asset)
+    except SystemExit:
+        return None
+
+
+def build_assets(force=0, watch=0):
+    """
+    Compiles all entry points given in ``ASSET_ENTRY_POINTS``.
+
+    Only entry points where the entry point itself or any file it imports
+    has changed since the last build are compiled. The builds run in
+    parallel (see ``ASSET_BUILD_PROCESSES``).
+
+    Usage::
+
+        fab build_assets
+        fab build_assets:force=1
+        fab build_assets:watch=1
+
+    :param force: If set to 1, all entry points are compiled.
+    :param watch: If set to 1, the task keeps running and compiles entry
+      points as soon as one of their files changes. Failed builds are
+      reported and retried once one of their files changes again.
+
+    """
+    build = _try_build_asset if int(watch) else _build_asset
+    # Maps entry points that failed to build to the mtimes of their files
+    failed = {}
+    stale = _get_stale_assets(force=int(force))
+    while True:
+        targets = run_parallel(
+            build, stale, getattr(settings, 'ASSET_BUILD_PROCESSES', None))
+        for (source, target), built in zip(stale, targets):
+            if built:
+                failed.pop(source, None)
+                puts(green('Built {0}'.format(target)))
+            else:
+                failed[source] = _get_mtimes(source)
+                warn(red('Building {0} failed.'.format(target)))
+        if not int(watch):
+            if not stale:
+                puts(green('All assets are up to date.'))
+            return
+        time.sleep(getattr(settings, 'ASSET_WATCH_INTERVAL', 1))
+        stale = [(source, target) for source, target in _get_stale_assets()
+                 if failed.get(source) != _get_mtimes(source)]
@@ -0,0 +1,238 @@
+"""
+Helpers for a deduplicating store of database dumps and media folders.
+
+A snapshot is a file or a directory tree. Every file is split into chunks
+of ``CHUNK_SIZE`` bytes. Each chunk is stored once, compressed and named
+after its sha256 hash::
+
+    <store>/chunks/ab/ab12...
+    <store>/snapshots/<kind>-<YYYYmmdd-HHMMSS>.json
+
+Fixed-size chunks are cheap to compute, since hashing and compression run
+in C. They only deduplicate data that doesn't move, so snapshots should
+consist of many files that change independently: a directory format dump
+(``pg_dump -Fd -Z0`` writes one file per table) or the media folder
+itself (see ``fab run_backup_db`` and ``fab run_download_db:from_store=1``).
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import zlib
+
+from django.conf import settings
+
+from fabric.utils import abort
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Fast compression keeps the CPU time of a backup close to reading the data
+COMPRESSION_LEVEL = 1
+
+
+def iter_chunks(fileobj):
+    """Yields the chunks of the given binary file."""
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_files(path):
+    """
+    Yields the files of a snapshot as ``(relative path, absolute path)``.
+
+    A single file has the relative path ``.``.
+
+    """
+    if not os.path.isdir(path):
+        yield os.curdir, path
+        return
+    for directory, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            absolute_path = os.path.join(directory, filename)
+            if os.path.isfile(absolute_path):
+                yield os.path.relpath(absolute_path, path), absolute_path
+
+
+def get_store_dir():
+    """Returns the local backup store."""
+    return getattr(settings, 'BACKUP_STORE_DIR', 'backup_store')
+
+
+def get_chunk_path(chunk_id):
+    """Returns the path of a chunk relative to ``<store>/chunks``."""
+    return os.path.join(chunk_id[:2], chunk_id)
+
+
+def get_latest_snapshot(names):
+    """Returns the latest of the given snapshot names or ``None``."""
+    return sorted(names)[-1] if names else None
+
+
+def get_missing_chunks(store, chunk_ids):
+    """Returns the paths of the given chunks that are not in the store."""
+    paths = [get_chunk_path(chunk_id) for chunk_id in set(chunk_ids)]
+    return sorted(path for path in paths
+                  if not os.path.exists(os.path.join(store, 'chunks', path)))
+
+
+def list_snapshots(store, kind=None):
+    """Returns the sorted names of all snapshots (of the given kind)."""
+    directory = os.path.join(store, 'snapshots')
+    if not os.path.isdir(directory):
+        return []
+    names = [os.path.splitext(filename)[0]
+             for filename in os.listdir(directory)
+             if filename.endswith('.json')]
+    if kind:
+        names = [name for name in names if name.startswith(kind + '-')]
+    return sorted(names)
+
+
+def load_snapshot(store, name):
+    """Returns the contents of the given snapshot."""
+    path = os.path.join(store, 'snapshots', '{0}.json'.format(name))
+    with open(path) as snapshot_file:
+        return json.load(snapshot_file)
+
+
+def get_chunk_ids(snapshot):
+    """Returns the ids of all chunks the given snapshot uses."""
+    chunk_ids = set()
+    for file_chunk_ids in snapshot['files'].values():
+        chunk_ids.update(file_chunk_ids)
+    return chunk_ids
+
+
+def _store_chunk(store, chunk):
+    """
+    Writes the chunk unless it is already stored.
+
+    :returns: The chunk id and ``True`` if the chunk is new.
+
+    """
+    chunk_id = hashlib.sha256(chunk).hexdigest()
+    chunk_path = os.path.join(store, 'chunks', get_chunk_path(chunk_id))
+    if os.path.exists(chunk_path):
+        return chunk_id, False
+    if not os.path.isdir(os.path.dirname(chunk_path)):
+        os.makedirs(os.path.dirname(chunk_path))
+    # Write to a temporary file first so that an interrupted backup never
+    # leaves a broken chunk behind
+    with open(chunk_path + '.tmp', 'wb') as chunk_file:
+        chunk_file.write(zlib.compress(chunk, COMPRESSION_LEVEL))
+    os.rename(chunk_path + '.tmp', chunk_path)
+    return chunk_id, True
+
+
+def add_snapshot(store, path, kind):
+    """
+    Stores the chunks of the given file or directory that are new.
+
+    :returns: The name of the new snapshot and the number of new chunks.
+
+    """
+    files = {}
+    new_chunks = 0
+    size = 0
+    for relative_path, absolute_path in iter_files(path):
+        chunk_ids = files[relative_path] = []
+        with open(absolute_path, 'rb') as source:
+            for chunk in iter_chunks(source):
+                chunk_id, is_new = _store_chunk(store, chunk)
+                chunk_ids.append(chunk_id)
+                new_chunks += is_new
+                size += len(chunk)
+
+    name = '{0}-{1}'.format(kind, time.strftime('%Y%m%d-%H%M%S'))
+    snapshot_dir = os.path.join(store, 'snapshots')
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    with open(os.path.join(snapshot_dir, name + '.json'), 'w') as snapshot:
+        json.dump({'kind': kind, 'date': time.time(), 'size': size,
+                   'files': files}, snapshot)
+    return name, new_chunks
+
+
+def restore_snapshot(store, name, path):
+    """
+    Writes the file or directory of the given snapshot to ``path``.
+
+    An existing file or directory at ``path`` is replaced.
+
+    """
+    files = load_snapshot(store, name)['files']
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    for relative_path, chunk_ids in sorted(files.items()):
+        target_path = os.path.normpath(os.path.join(path, relative_path))
+        if not os.path.isdir(os.path.dirname(target_path) or os.curdir):
+            os.makedirs(os.path.dirname(target_path))
+        with open(target_path, 'wb') as target:
+            for chunk_id in chunk_ids:
+                chunk_path = os.path.join(
+                    store, 'chunks', get_chunk_path(chunk_id))
+                with open(chunk_path, 'rb') as chunk_file:
+                    chunk = zlib.decompress(chunk_file.read())
+                if hashlib.sha256(chunk).hexdigest() != chunk_id:
+                    abort('Chunk {0} is corrupt.'.format(chunk_id))
+                target.write(chunk)
+
+
+def get_retained_snapshots(names, keep_last, keep_daily):
+    """
+    Returns the snapshots that the retention policy keeps.
+
+    :param names: Snapshot names of one kind, sorted by date.
+    :param keep_last: Number of most recent snapshots to keep.
+    :param keep_daily: Number of most recent days for which the last
+      snapshot of the day is kept.
+
+    """
+    retained = set(names[-keep_last:] if keep_last else [])
+    days = {}
+    for name in names:
+        # Names end with YYYYmmdd-HHMMSS, later snapshots overwrite earlier
+        days[name.rsplit('-', 2)[-2]] = name
+    for day in sorted(days)[-keep_daily:] if keep_daily else []:
+        retained.add(days[day])
+    return retained
+
+
+def prune_store(store, keep_last, keep_daily):
+    """
+    Removes snapshots according to the retention policy and unused chunks.
+
+    :returns: The number of removed snapshots and chunks.
+
+    """
+    kinds = set(name.rsplit('-', 2)[0] for name in list_snapshots(store))
+    removed_snapshots = 0
+    for kind in kinds:
+        names = list_snapshots(store, kind)
+        retained = get_retained_snapshots(names, keep_last, keep_daily)
+        for name in names:
+            if name not in retained:
+                os.remove(os.path.join(
+                    store, 'snapshots', '{0}.json'.format(name)))
+                removed_snapshots += 1
+
+    referenced = set()
+    for name in list_snapshots(store):
+        referenced.update(get_chunk_ids(load_snapshot(store, name)))
+    removed_chunks = 0
+    chunk_dir = os.path.join(store, 'chunks')
+    for directory, dirnames, filenames in os.walk(chunk_dir):
+        for filename in filenames:
+            if filename not in referenced:
+                os.remove(os.path.join(directory, filename))
+                removed_chunks += 1
+    return removed_snapshots, removed_chunks
@@ -0,0 +1,179 @@
+"""
+Helpers for test impact analysis based on coverage contexts.
+
+A full test run records which test executed which line. The resulting index
+is used to select the tests that are affected by the changes in the working
+tree (see ``fab test:impacted=1``).
+
+"""
+import fnmatch
+import json
+import os
+import re
+
+from django.conf import settings
+
+from fabric.api import hide, local
+from fabric.api import settings as fab_settings
+
+try:
+    from configparser import ConfigParser
+except ImportError:  # Python 2
+    from ConfigParser import SafeConfigParser as ConfigParser
+
+
+HUNK_PATTERN = re.compile(r'^@@ -(\d+)(?:,(\d+))? ')
+
+# Indexes with another version are rebuilt
+INDEX_VERSION = 2
+
+# Changes to files that match these patterns don't affect any test
+IMPACT_IGNORE_PATTERNS = ['*.md', '*.rst', '*.txt', '.gitignore']
+
+
+def get_index_path():
+    """Returns the path of the impact index."""
+    return getattr(settings, 'TEST_IMPACT_INDEX', '.test_impact_index.json')
+
+
+def write_rcfile(path):
+    """
+    Writes a coverage config that records a context for every test.
+
+    The project's ``.coveragerc`` is extended if there is one.
+
+    """
+    config = ConfigParser()
+    config.read('.coveragerc')
+    if not config.has_section('run'):
+        config.add_section('run')
+    config.set('run', 'dynamic_context', 'test_function')
+    with open(path, 'w') as rcfile:
+        config.write(rcfile)
+
+
+def build_index():
+    """Builds the impact index from the coverage data of a full test run."""
+    from coverage import CoverageData
+    data = CoverageData()
+    data.read()
+    files = {}
+    for filename in data.measured_files():
+        lines = {}
+        for lineno, contexts in data.contexts_by_lineno(filename).items():
+            # Lines that only run at import time (e.g. class attributes) have
+            # no test context. They are kept with an empty list, since their
+            # changes can affect any test.
+            lines[str(lineno)] = sorted(
+                context for context in contexts if context)
+        files[os.path.relpath(filename)] = lines
+    with fab_settings(hide('everything')):
+        commit = local('git rev-parse HEAD', capture=True)
+    with open(get_index_path(), 'w') as index_file:
+        json.dump({'version': INDEX_VERSION, 'commit': commit,
+                   'files': files}, index_file)
+
+
+def parse_diff(diff):
+    """
+    Returns the changed lines of the given ``git diff -U0`` output.
+
+    Line numbers refer to the old version of each file. Pure additions are
+    attributed to the lines around the insertion point. New files map to
+    ``None``.
+
+    :returns: A dict ``{path: set of line numbers or None}``.
+
+    """
+    changed = {}
+    path = None
+    for line in diff.splitlines():
+        if line.startswith('--- '):
+            path = None if line == '--- /dev/null' else line[6:]
+        elif line.startswith('+++ ') and path is None:
+            changed[line[6:]] = None
+        elif path is not None:
+            match = HUNK_PATTERN.match(line)
+            if match:
+                start = int(match.group(1))
+                count = int(match.group(2) or 1)
+                lines = changed.setdefault(path, set())
+                if count:
+                    lines.update(range(start, start + count))
+                else:
+                    lines.update((start, start + 1))
+    return changed
+
+
+def get_changed_lines(commit):
+    """
+    Returns the lines that changed in the working tree since ``commit``.
+
+    Paths are relative to the current directory and line numbers refer to
+    the version of ``commit`` so that they can be looked up in the index.
+    See ``parse_diff`` for the format.
+
+    """
+    with fab_settings(hide('everything')):
+        diff = local(
+            'git diff -U0 --no-color --no-renames --relative {0} --'.format(
+                commit), capture=True)
+        untracked = local('git ls-files --others --exclude-standard',
+                          capture=True)
+    changed = dict((path, None) for path in untracked.splitlines())
+    changed.update(parse_diff(diff))
+    return changed
+
+
+def select_tests(files, changed, pattern, ignore_patterns=()):
+    """
+    Returns the tests that are affected by the given changes.
+
+    :param files: The ``files`` of the impact index.
+    :param changed: The result of ``get_changed_lines``.
+    :param pattern: The pattern of test module file names.
+    :param ignore_patterns: Changes to files matching these are ignored.
+    :returns: A sorted list of test labels or ``None`` if all tests must run.
+
+    """
+    tests = set()
+    for path, lines in changed.items():
+        if any(fnmatch.fnmatch(path, p) for p in ignore_patterns):
+            continue
+        if fnmatch.fnmatch(os.path.basename(path), pattern):
+            if os.path.exists(path):
+                tests.add(os.path.splitext(path)[0].replace(os.sep, '.'))
+            continue
+        if path not in files or lines is None:
+            return None
+        for lineno in lines:
+            line_tests = files[path].get(str(lineno))
+            if line_tests == []:
+                # The line ran outside of any test, e.g. at import time
+                return None
+            tests.update(line_tests or [])
+    return sorted(tests)
+
+
+def get_impacted_tests(pattern):
+    """
+    Returns the test labels that are affected by the working tree changes.
+
+    :param pattern: The pattern of test module file names.
+    :returns: A sorted list of test labels or ``None`` if the index is
+      missing or can't tell which tests are affected.
+
+    """
+    if not os.path.exists(get_index_path()):
+        return None
+    with open(get_index_path()) as index_file:
+        index = json.load(index_file)
+    if index.get('version') != INDEX_VERSION:
+        return None
+    with fab_settings(hide('everything'), warn_only=True):
+        if local('git cat-file -e {0}'.format(index['commit'])).failed:
+            return None
+    ignore_patterns = getattr(
+        settings, 'TEST_IMPACT_IGNORE', IMPACT_IGNORE_PATTERNS)
+    return select_tests(index['files'], get_changed_lines(index['commit']),
+                        pattern, ignore_patterns)
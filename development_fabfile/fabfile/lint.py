@@ -0,0 +1,230 @@
+"""Fab tasks that keep lint results of the local codebase up to date."""
+import fnmatch
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+from fabric.colors import green, red
+from fabric.utils import puts, warn
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+
+FLAKE8_OPTIONS = (
+    '--ignore=E126,W504,W503 --max-line-length=120'
+    ' --exclude=__pycache__,*/migrations/*,*/settings/*,*.wsgi,*.asgi')
+
+
+def _get_socket_path():
+    """Returns the path of the socket the lint daemon listens on."""
+    return os.path.abspath(
+        getattr(settings, 'LINT_DAEMON_SOCKET', '.lint_daemon.sock'))
+
+
+def _query_lint_daemon(check):
+    """
+    Asks a running lint daemon for the current results of the given check.
+
+    :param check: One of ``flake8``, ``syntax_check`` or ``jshint``.
+    :returns: A list of error messages or ``None`` if no daemon is running.
+
+    """
+    path = _get_socket_path()
+    if not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall('{0}\n'.format(check).encode('utf-8'))
+        response = b''
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+    except socket.error:
+        return None
+    finally:
+        client.close()
+    return json.loads(response.decode('utf-8'))
+
+
+def _run(command):
+    """Runs the given command and returns its output."""
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return process.communicate()[0].decode('utf-8', 'replace')
+
+
+class _LintDaemon(object):
+    """Lints changed files and keeps the results in memory."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while changed files are looked up and linted
+        self.update_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.mtimes = {}
+        self.results = {'flake8': {}, 'syntax_check': {}, 'jshint': {}}
+        self.jshint_installed = not subprocess.call(
+            'command -v jshint > /dev/null', shell=True)
+        if not self.jshint_installed:
+            warn(red(
+                "To enable an extended check of your js files, please"
+                " install jshint by entering:\n\n    npm install -g jshint"
+            ))
+
+    def get_errors(self, check):
+        """Returns a sorted list of all error messages for the check."""
+        with self.lock:
+            return [message for path in sorted(self.results[check])
+                    for message in self.results[check][path]]
+
+    def get_changed_files(self):
+        """Returns the files that were changed or removed since last time."""
+        mtimes = {}
+        for directory, dirnames, filenames in os.walk('.'):
+            dirnames[:] = [
+                name for name in dirnames
+                if not name.startswith('.') and name != 'node_modules']
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    mtimes[path] = os.path.getmtime(path)
+                except OSError:
+                    continue
+        changed = [path for path, mtime in mtimes.items()
+                   if self.mtimes.get(path) != mtime]
+        changed += [path for path in self.mtimes if path not in mtimes]
+        self.mtimes = mtimes
+        return changed
+
+    def lint(self, paths):
+        """Updates the results for the given files."""
+        results = {'flake8': {}, 'syntax_check': {}, 'jshint': {}}
+        existing = [path for path in paths if os.path.exists(path)]
+        python_files = [path for path in existing if path.endswith('.py')]
+        for start in range(0, len(python_files), 200):
+            output = _run(['flake8'] + FLAKE8_OPTIONS.split() +
+                          python_files[start:start + 200])
+            for line in output.splitlines():
+                results['flake8'].setdefault(
+                    line.split(':', 1)[0], []).append(line)
+
+        for path in existing:
+            if any(s in path for s in settings.SYNTAX_CHECK_EXCLUDES):
+                continue
+            for file_type, pattern in settings.SYNTAX_CHECK.items():
+                if not fnmatch.fnmatch(os.path.basename(path), file_type):
+                    continue
+                with io.open(path, encoding='utf-8',
+                             errors='replace') as checked_file:
+                    lines = checked_file.read().splitlines()
+                found = ['{0}:{1}'.format(number, line)
+                         for number, line in enumerate(lines, 1)
+                         if re.search(pattern, line, re.IGNORECASE)]
+                if found:
+                    results['syntax_check'][path] = [
+                        "Syntax check found in '{0}': {1}".format(
+                            path, '\n'.join(found))]
+
+        excludes = getattr(settings, 'JSHINT_CHECK_EXCLUDES',
+                           settings.SYNTAX_CHECK_EXCLUDES)
+        for path in existing:
+            if (not self.jshint_installed or not path.endswith('.js') or
+                    any(s in path for s in excludes)):
+                continue
+            output = _run(['jshint', path])
+            if output:
+                results['jshint'][path] = [
+                    'JS errors detected in file {0}\n{1}'.format(
+                        path, output)]
+
+        with self.lock:
+            for check, check_results in self.results.items():
+                for path in paths:
+                    check_results.pop(path, None)
+                check_results.update(results[check])
+
+    def update(self):
+        """
+        Lints the files that changed since the last update.
+
+        Waits for an update that is already running, so that afterwards the
+        results match the files on disk.
+
+        :returns: The changed files.
+
+        """
+        with self.update_lock:
+            changed = self.get_changed_files()
+            if changed:
+                self.lint(changed)
+            return changed
+
+    def watch(self, interval):
+        """Lints all changed files every ``interval`` seconds."""
+        while True:
+            changed = self.update()
+            if changed and self.ready.is_set():
+                puts('Re-linted {0} changed files.'.format(len(changed)))
+            self.ready.set()
+            time.sleep(interval)
+
+
+class _LintRequestHandler(socketserver.StreamRequestHandler):
+    """Answers a check name with the JSON encoded list of its errors."""
+    def handle(self):
+        check = self.rfile.readline().decode('utf-8').strip()
+        self.server.lint_daemon.ready.wait()
+        # Files may have changed since the last pass. Scanning the mtimes is
+        # cheap, so unchanged trees are still answered right away.
+        self.server.lint_daemon.update()
+        self.wfile.write(json.dumps(
+            self.server.lint_daemon.get_errors(check)).encode('utf-8'))
+
+
+class _LintServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def lint_daemon():
+    """
+    Keeps flake8, syntax_check and jshint results up to date in memory.
+
+    The daemon lints the whole codebase once, then watches it and re-lints
+    only the files that change. While it is running, ``fab flake8``,
+    ``fab syntax_check`` and ``fab jshint`` ask the daemon via the socket
+    given in ``LINT_DAEMON_SOCKET`` instead of linting from scratch.
+
+    Usage::
+
+        fab lint_daemon
+
+    """
+    path = _get_socket_path()
+    if os.path.exists(path):
+        os.remove(path)
+    daemon = _LintDaemon()
+    server = _LintServer(path, _LintRequestHandler)
+    server.lint_daemon = daemon
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    puts(green('Lint daemon listening on {0}'.format(path)))
+    try:
+        daemon.watch(getattr(settings, 'LINT_DAEMON_INTERVAL', 0.5))
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(path)
@@ -0,0 +1,124 @@
+"""Helpers to send timed HTTP requests to a server."""
+import itertools
+import math
+import threading
+import time
+
+from .utils import run_parallel
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import urlopen
+
+
+# Upper bounds of the latency histogram buckets in milliseconds
+HISTOGRAM_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def fetch(url, timeout=30):
+    """
+    Requests the given URL and reads the whole response.
+
+    :returns: A tuple of the latency in seconds and ``True`` if the request
+      succeeded with a status below 400.
+
+    """
+    start = time.time()
+    try:
+        response = urlopen(url, timeout=timeout)
+        response.read()
+        response.close()
+        succeeded = True
+    except Exception:
+        succeeded = False
+    return time.time() - start, succeeded
+
+
+def percentile(values, percent):
+    """Returns the given percentile (nearest rank) of the values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def run_requests(urls, concurrency):
+    """
+    Requests all given URLs, ``concurrency`` at a time.
+
+    :returns: A tuple of the latencies of all successful requests and the
+      number of failed requests.
+
+    """
+    results = run_parallel(fetch, urls, concurrency)
+    latencies = [latency for latency, succeeded in results if succeeded]
+    return latencies, len(results) - len(latencies)
+
+
+def run_load(urls, concurrency, duration):
+    """
+    Requests the given URLs in turn from ``concurrency`` threads.
+
+    :param duration: Number of seconds after which no new requests are sent.
+    :returns: A tuple of the latencies of all successful requests, the
+      number of failed requests and the elapsed seconds.
+
+    """
+    latencies = []
+    errors = [0]
+    counter = itertools.count()
+    lock = threading.Lock()
+    start = time.time()
+    deadline = start + duration
+
+    def worker():
+        while time.time() < deadline:
+            url = urls[next(counter) % len(urls)]
+            latency, succeeded = fetch(url)
+            with lock:
+                if succeeded:
+                    latencies.append(latency)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for index in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.time() - start
+
+
+def get_histogram(latencies):
+    """
+    Counts the latencies per bucket of ``HISTOGRAM_BUCKETS`` milliseconds.
+
+    :returns: A list of ``(upper bound in ms or None, count)`` tuples.
+
+    """
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for latency in latencies:
+        milliseconds = latency * 1000
+        index = 0
+        while (index < len(HISTOGRAM_BUCKETS) and
+               milliseconds > HISTOGRAM_BUCKETS[index]):
+            index += 1
+        counts[index] += 1
+    return list(zip(list(HISTOGRAM_BUCKETS) + [None], counts))
+
+
+def summarize(latencies, errors, elapsed):
+    """Returns throughput, latency percentiles and histogram as a dict."""
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50': round(percentile(latencies, 50) * 1000, 1),
+        'p95': round(percentile(latencies, 95) * 1000, 1),
+        'p99': round(percentile(latencies, 99) * 1000, 1),
+        'histogram': get_histogram(latencies),
+    }
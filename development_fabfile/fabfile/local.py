@@ -1,8 +1,13 @@
 """Fabfile for tasks that only manipulate things on the local machine."""
 import django
+import hashlib
+import json
 import os
 import re
+import socket
 import sys
+import tempfile
+import time
 
 from django.conf import settings
 
@@ -13,7 +18,17 @@ from fabric.colors import green, red
 from fabric.utils import abort, warn, puts
 from fabric.state import env
 
+from . import backup_store, impact, sharding
+from .lint import FLAKE8_OPTIONS, _query_lint_daemon
 from .servers import local_machine
+from .utils import (
+    get_profile_path, print_profile_stats, profile_command, run_local,
+    run_parallel)
+
+try:
+    from shlex import quote
+except ImportError:  # Python 2
+    from pipes import quote
 
 
 HOST = ' -h localhost'
@@ -29,6 +44,405 @@ else:
     PYTHON_VERSION = '{}.{}'.format(
         sys.version_info.major, sys.version_info.minor)
 
+TEST_PATTERN = '*_tests.py'
+
+# Prints the directories that collectstatic and compilemessages write to
+ARTIFACT_DIRS_SCRIPT = (
+    "import django, json, os; django.setup();"
+    " from django.apps import apps; from django.conf import settings;"
+    " print(json.dumps({'static_root': os.path.abspath(settings.STATIC_ROOT),"
+    " 'locale_dirs': [os.path.abspath(path) for path in"
+    " list(settings.LOCALE_PATHS) + [os.path.join(config.path, 'locale')"
+    " for config in apps.get_app_configs()]]}))")
+
+# Prints the values of the test settings that affect the test DB. The
+# migrations are loaded from the apps of the test settings as well.
+TEST_SETTINGS_SCRIPT = """
+import django, hashlib, json, sys
+django.setup()
+from django.conf import settings
+from django.db.migrations.loader import MigrationLoader
+loader = MigrationLoader(None, ignore_no_migrations=True)
+migrations = hashlib.sha1()
+for key in sorted(loader.disk_migrations):
+    filename = sys.modules[loader.disk_migrations[key].__module__].__file__
+    if filename.endswith('.pyc'):
+        filename = filename[:-1]
+    migrations.update('{0}.{1}'.format(*key).encode('utf-8'))
+    with open(filename, 'rb') as migration_file:
+        migrations.update(migration_file.read())
+database = settings.DATABASES['default']
+print(json.dumps({
+    'installed_apps': list(settings.INSTALLED_APPS),
+    'migrations': migrations.hexdigest(),
+    'engine': database['ENGINE'],
+    'host': database.get('HOST') or '',
+    'port': str(database.get('PORT') or ''),
+    'user': database.get('USER') or '',
+    'password': database.get('PASSWORD') or '',
+    'test_db_name': (database.get('TEST') or {}).get('NAME') or
+    'test_' + database['NAME'],
+}))
+"""
+
+# Runs via ``python -c`` because ``manage.py shell -c`` needs Django 1.10
+RESET_PASSWORDS_SCRIPT = (
+    "import django; django.setup();"
+    " from django.contrib.auth import get_user_model;"
+    " from django.contrib.auth.hashers import make_password;"
+    " print(get_user_model()._default_manager.update("
+    "password=make_password('{0}', hasher='{1}')))")
+
+
+def _get_db_template_name():
+    """Returns the template name for the current state of the migrations."""
+    return '{0}_template_{1}'.format(
+        env.db_name, _get_migrations_fingerprint()[:10])
+
+
+def _get_migrations_fingerprint():
+    """Returns a hash over the names and contents of all migration files."""
+    django.setup()
+    from django.db.migrations.loader import MigrationLoader
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    fingerprint = hashlib.sha1()
+    for key in sorted(loader.disk_migrations):
+        module = sys.modules[loader.disk_migrations[key].__module__]
+        filename = module.__file__
+        if filename.endswith('.pyc'):
+            filename = filename[:-1]
+        fingerprint.update('{0}.{1}'.format(*key).encode('utf-8'))
+        with open(filename, 'rb') as migration_file:
+            fingerprint.update(migration_file.read())
+    return fingerprint.hexdigest()
+
+
+def _psql_query(query, db_name='', warn_only=False):
+    """
+    Runs the given query as the admin role and returns the raw result.
+
+    :param warn_only: If ``True``, ``None`` is returned if the query fails.
+
+    """
+    return run_local('psql {0} {1} -tAc "{2}"'.format(
+        USER_AND_HOST, db_name, query), warn_only=warn_only)
+
+
+def _anonymize_table(job):
+    """
+    Runs the anonymization UPDATEs for one table.
+
+    Tables with an integer primary key are updated in chunks of
+    ``ANONYMIZE_CHUNK_SIZE`` rows so that every transaction stays small.
+
+    """
+    table, pk_column, assignments, chunked = job
+    chunk_size = getattr(settings, 'ANONYMIZE_CHUNK_SIZE', 50000)
+    update = 'UPDATE {0} SET {1}'.format(table, ', '.join(assignments))
+    if not chunked:
+        _psql(update)
+        return table
+    bounds = _psql('SELECT min({0}), max({0}) FROM {1}'.format(
+        pk_column, table))
+    lowest, highest = bounds.split('|')
+    if not lowest:
+        return table
+    for start in range(int(lowest), int(highest) + 1, chunk_size):
+        _psql('{0} WHERE {1} >= {2} AND {1} < {3}'.format(
+            update, pk_column, start, start + chunk_size))
+    return table
+
+
+def _get_artifact_dirs():
+    """
+    Returns the directories the artifacts are built into.
+
+    The directories are read from ``ARTIFACT_SETTINGS`` (if set), since
+    ``build_artifacts`` runs collectstatic and compilemessages with them.
+
+    :returns: A tuple of the absolute ``STATIC_ROOT`` and a list of the
+      locale directories of ``LOCALE_PATHS`` and all installed apps that are
+      part of the project.
+
+    """
+    command = 'python{0} -c "{1}"'.format(PYTHON_VERSION, ARTIFACT_DIRS_SCRIPT)
+    if getattr(settings, 'ARTIFACT_SETTINGS', None):
+        command = 'DJANGO_SETTINGS_MODULE={0} {1}'.format(
+            settings.ARTIFACT_SETTINGS, command)
+    dirs = json.loads(run_local(command).splitlines()[-1])
+    project_root = os.getcwd()
+    locale_dirs = []
+    for path in dirs['locale_dirs']:
+        relative_path = os.path.relpath(path, project_root)
+        # Skip apps outside of the project and in an in-tree virtualenv
+        if (relative_path.startswith(os.pardir) or
+                'site-packages' in relative_path.split(os.sep)):
+            continue
+        locale_dirs.append(path)
+    return dirs['static_root'], sorted(set(locale_dirs))
+
+
+def _get_artifact_manifest(static_root, locale_dirs):
+    """
+    Returns the checksums of all collected static files and compiled messages.
+
+    See ``_get_artifact_dirs`` for the parameters.
+
+    :returns: A dict ``{'static': {path: sha1}, 'locale': {path: sha1}}`` with
+      paths relative to ``STATIC_ROOT`` and the project root respectively.
+
+    """
+    manifest = {'static': {}, 'locale': {}}
+    project_root = os.getcwd()
+    roots = [('static', static_root, static_root)] + [
+        ('locale', locale_dir, project_root) for locale_dir in locale_dirs]
+    for kind, root, relative_to in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [
+                name for name in dirnames if not name.startswith('.')]
+            for filename in filenames:
+                if kind == 'locale' and not filename.endswith('.mo'):
+                    continue
+                path = os.path.join(directory, filename)
+                with open(path, 'rb') as artifact_file:
+                    manifest[kind][os.path.relpath(path, relative_to)] = (
+                        hashlib.sha1(artifact_file.read()).hexdigest())
+    return manifest
+
+
+def _get_test_settings(test_settings, pythonpath=None):
+    """
+    Returns the values of the test settings that affect the test DB.
+
+    The settings of the fabfile may differ from the test settings, so the
+    values and the migrations fingerprint are read in a separate process.
+
+    """
+    command = 'DJANGO_SETTINGS_MODULE={0} python{1} -c {2}'.format(
+        test_settings, PYTHON_VERSION, quote(TEST_SETTINGS_SCRIPT))
+    if pythonpath:
+        command = 'PYTHONPATH={0}:$PYTHONPATH {1}'.format(pythonpath, command)
+    return json.loads(run_local(command).splitlines()[-1])
+
+
+def _get_test_db_fingerprint(test_settings, test_settings_values):
+    """Returns a hash that changes whenever the test DB must be re-created."""
+    fingerprint = hashlib.sha1(
+        test_settings_values['migrations'].encode('utf-8'))
+    fingerprint.update(test_settings.encode('utf-8'))
+    for app in test_settings_values['installed_apps']:
+        fingerprint.update(app.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def _drop_test_db(test_settings_values):
+    """
+    Drops the Postgres test DB as the DB user of the test settings.
+
+    :returns: ``False`` if the DB could not be dropped.
+
+    """
+    command = 'psql -w -h {0} -U {1} -d postgres -c {2}'.format(
+        test_settings_values['host'] or 'localhost',
+        test_settings_values['user'] or settings.LOCAL_PG_ADMIN_ROLE,
+        quote('DROP DATABASE IF EXISTS "{0}"'.format(
+            test_settings_values['test_db_name'])))
+    if test_settings_values['port']:
+        command += ' -p {0}'.format(test_settings_values['port'])
+    if test_settings_values['password']:
+        command = 'PGPASSWORD={0} {1}'.format(
+            quote(test_settings_values['password']), command)
+    return run_local(command, warn_only=True) is not None
+
+
+def _import_verified_media(archive):
+    """Extracts all files from the archive that differ from the manifest."""
+    manifest = '{0}.sha1'.format(archive)
+    if not os.path.exists(manifest):
+        abort(red('ERROR: There is no checksum manifest {0}. Download it with'
+                  ' run_download_media:verified=1.'.format(manifest)))
+    changed_list = '{0}.changed'.format(archive)
+    with lcd(settings.MEDIA_ROOT):
+        with fab_settings(hide('everything'), warn_only=True):
+            result = local('sha1sum --quiet -c {0} 2>/dev/null'.format(
+                manifest), capture=True)
+        changed = [line.rsplit(': FAILED', 1)[0]
+                   for line in result.splitlines() if ': FAILED' in line]
+        if not changed:
+            puts(green('All media files are up to date.'))
+            return
+        with open(changed_list, 'w') as changed_file:
+            changed_file.write('\n'.join(changed) + '\n')
+        local('$(command -v pigz || echo gzip) -dc {0}'
+              ' | tar -xf - -T {1}'.format(archive, changed_list))
+        local('rm -f {0}'.format(changed_list))
+        local('sha1sum --quiet -c {0}'.format(manifest))
+    puts(green('Extracted {0} changed media files.'.format(len(changed))))
+
+
+def _report_lint_daemon_errors(check):
+    """
+    Prints the results of a running ``lint_daemon`` for the given check.
+
+    Aborts if the daemon reports errors.
+
+    :returns: ``True`` if a daemon answered, ``False`` if none is running.
+
+    """
+    errors = _query_lint_daemon(check)
+    if errors is None:
+        return False
+    for error in errors:
+        warn(red(error))
+    if errors:
+        abort(red('There have been errors. Please fix them and run'
+                  ' the check again.'))
+    return True
+
+
+def _psql(query):
+    """Runs the given query against the local database as the db role."""
+    return run_local('psql -U {0}{1} {2} -tA -c {3}'.format(
+        env.db_role, HOST, env.db_name, quote(query)))
+
+
+def build_artifacts():
+    """
+    Runs collectstatic and compilemessages locally and writes a manifest.
+
+    The manifest (``ARTIFACT_MANIFEST_FILENAME``) contains the checksums of
+    all collected static files and compiled messages. Use
+    ``fab <server> run_upload_artifacts`` to ship only the changed files to
+    the servers. Set ``ARTIFACT_SETTINGS`` if the build needs different
+    settings, e.g. your production static files storage.
+
+    Usage::
+
+        fab build_artifacts
+
+    """
+    settings_option = ''
+    if getattr(settings, 'ARTIFACT_SETTINGS', None):
+        settings_option = ' --settings={0}'.format(settings.ARTIFACT_SETTINGS)
+    local('python{0} manage.py collectstatic --noinput{1}'.format(
+        PYTHON_VERSION, settings_option))
+    local('python{0} manage.py compilemessages{1}'.format(
+        PYTHON_VERSION, settings_option))
+    with open(settings.ARTIFACT_MANIFEST_FILENAME, 'w') as manifest_file:
+        json.dump(_get_artifact_manifest(*_get_artifact_dirs()),
+                  manifest_file, indent=1, sort_keys=True)
+
+
+def _run_tests(options, integration, selenium, test_settings, keepdb,
+               coverage_options='', coverage_file=None, pythonpath=None):
+    """
+    Runs manage.py test under coverage. See ``test`` for the options.
+
+    :param coverage_file: The coverage data file, if it should not be the
+      default ``.coverage``.
+    :param pythonpath: A directory that is prepended to ``PYTHONPATH``.
+    :returns: The result of the test command.
+
+    """
+    command = (
+        "coverage run{0} --source='.' manage.py test -v 2 --failfast"
+        " --settings={1} --pattern='{2}'".format(
+            coverage_options, test_settings, TEST_PATTERN))
+    if coverage_file:
+        command = 'COVERAGE_FILE={0} {1}'.format(coverage_file, command)
+    if pythonpath:
+        command = 'PYTHONPATH={0}:$PYTHONPATH {1}'.format(pythonpath, command)
+    if int(integration) == 0:
+        command += " --exclude='integration_tests'"
+    if int(selenium) == 0:
+        command += " --exclude='selenium_tests'"
+    if int(keepdb):
+        fingerprint_file = getattr(
+            settings, 'TEST_DB_FINGERPRINT_FILE', '.test_db_fingerprint')
+        test_settings_values = _get_test_settings(test_settings, pythonpath)
+        fingerprint = _get_test_db_fingerprint(
+            test_settings, test_settings_values)
+        try:
+            with open(fingerprint_file) as stored_file:
+                is_unchanged = stored_file.read() == fingerprint
+        except IOError:
+            is_unchanged = False
+        if is_unchanged or (
+                'postgresql' in test_settings_values['engine'] and
+                _drop_test_db(test_settings_values)):
+            # After the stale DB was dropped, --keepdb creates a fresh one
+            # that is kept for the next runs
+            command += ' --keepdb'
+        else:
+            # Let the test runner replace the stale DB. The next run creates
+            # a fresh one with --keepdb.
+            warn('The test DB is recreated once because it is outdated.')
+            command += ' --noinput'
+    if options:
+        command += ' {0}'.format(options)
+    with fab_settings(warn_only=True):
+        result = local(command, capture=False)
+    if int(keepdb):
+        with open(fingerprint_file, 'w') as stored_file:
+            stored_file.write(fingerprint)
+    return result
+
+
+def _start_ephemeral_db(test_settings):
+    """
+    Starts a throwaway Postgres cluster for the tests.
+
+    The cluster gets a unique directory and port, so parallel runs don't
+    collide. A settings module that extends ``test_settings`` and points the
+    default database to the cluster is written to the cluster directory, so
+    that coverage doesn't measure it. Add the directory to ``PYTHONPATH``
+    to use it.
+
+    :returns: A tuple of the cluster directory and the name of the generated
+      settings module.
+
+    """
+    bin_dir = getattr(settings, 'LOCAL_PG_BIN_DIR', '')
+    tmpfs = getattr(settings, 'EPHEMERAL_DB_DIR', '/dev/shm')
+    cluster_dir = tempfile.mkdtemp(
+        prefix='fab_test_db_', dir=tmpfs if os.path.isdir(tmpfs) else None)
+    free_socket = socket.socket()
+    free_socket.bind(('127.0.0.1', 0))
+    port = free_socket.getsockname()[1]
+    free_socket.close()
+
+    try:
+        # -N (no sync) also works on Postgres < 10, unlike --no-sync
+        local('{0}initdb -D {1}/data -U postgres --auth=trust -N'
+              ' > /dev/null'.format(bin_dir, cluster_dir))
+        local('{0}pg_ctl -D {1}/data -l {1}/postgres.log -w start'
+              ' -o "-p {2} -k {1} -c listen_addresses=\'\' -F'
+              ' -c synchronous_commit=off -c full_page_writes=off"'.format(
+                  bin_dir, cluster_dir, port))
+        module_name = 'ephemeral_test_settings_{0}'.format(port)
+        settings_path = os.path.join(cluster_dir, '{0}.py'.format(module_name))
+        with open(settings_path, 'w') as settings_file:
+            settings_file.write(
+                "from {0} import *  # NOQA\n\n"
+                "DATABASES['default'].update({{\n"
+                "    'HOST': '{1}',\n"
+                "    'PORT': '{2}',\n"
+                "    'USER': 'postgres',\n"
+                "    'PASSWORD': '',\n"
+                "}})\n".format(test_settings, cluster_dir, port))
+    except BaseException:
+        _stop_ephemeral_db(cluster_dir)
+        raise
+    return cluster_dir, module_name
+
+
+def _stop_ephemeral_db(cluster_dir):
+    """Stops and removes a cluster started by ``_start_ephemeral_db``."""
+    with fab_settings(warn_only=True):
+        local('{0}pg_ctl -D {1}/data -m immediate stop'.format(
+            getattr(settings, 'LOCAL_PG_BIN_DIR', ''), cluster_dir))
+    local('rm -rf {0}'.format(cluster_dir))
+
 
 def check():
     """Runs flake8, check_coverage and test."""
@@ -39,6 +453,146 @@ def check():
     check_coverage()
 
 
+def anonymize_db():
+    """
+    Anonymizes the local database according to ``ANONYMIZE_FIELDS``.
+
+    The setting maps model labels to a dict of field names and SQL
+    expressions, for example::
+
+        ANONYMIZE_FIELDS = {
+            'auth.User': {
+                'email': "'user' || id || '@example.com'",
+                'first_name': "'First'",
+            },
+        }
+
+    Every table is rewritten with chunked server-side UPDATEs and the tables
+    are processed in parallel (see ``ANONYMIZE_PROCESSES``).
+
+    Usage::
+
+        fab anonymize_db
+
+    """
+    local_machine()
+    django.setup()
+    from django.apps import apps
+    jobs = []
+    for label, fields in getattr(settings, 'ANONYMIZE_FIELDS', {}).items():
+        model = apps.get_model(label)
+        assignments = [
+            '{0} = {1}'.format(model._meta.get_field(name).column, expression)
+            for name, expression in sorted(fields.items())]
+        chunked = model._meta.pk.get_internal_type() in (
+            'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField')
+        jobs.append((model._meta.db_table, model._meta.pk.column,
+                     assignments, chunked))
+    for table in run_parallel(
+            _anonymize_table, jobs,
+            getattr(settings, 'ANONYMIZE_PROCESSES', None)):
+        puts(green('Anonymized {0}.'.format(table)))
+
+
+def _restore_snapshot(store, name, filename):
+    """
+    Restores a snapshot so that ``import_db`` or ``import_media`` can use it.
+
+    Media snapshots are packed into a tar archive at ``filename``.
+
+    """
+    if not name.startswith('media-'):
+        backup_store.restore_snapshot(store, name, filename)
+        return
+    media_dir = tempfile.mkdtemp()
+    try:
+        backup_store.restore_snapshot(store, name, media_dir)
+        local('tar -czf {0} -C {1} .'.format(filename, media_dir))
+    finally:
+        local('rm -rf {0}'.format(media_dir))
+
+
+def backup_store_add(path, kind, store=None):
+    """
+    Adds a file or directory to the backup store.
+
+    Every file is hashed and only chunks that are not in the store yet are
+    compressed and written. This costs about as much CPU time as reading
+    the data and compressing the changed parts with ``gzip -1``. Afterwards
+    all snapshots that are not kept by ``BACKUP_STORE_KEEP_LAST`` and
+    ``BACKUP_STORE_KEEP_DAILY`` are removed together with the chunks that
+    are no longer used. This usually runs on the server (see
+    ``run_backup_db`` and ``run_backup_media``).
+
+    Usage::
+
+        fab backup_store_add:path=foobar.dump,kind=db
+
+    :param kind: The kind of the backup, e.g. ``db`` or ``media``.
+    :param store: The store directory, defaults to ``BACKUP_STORE_DIR``.
+
+    """
+    store = store or backup_store.get_store_dir()
+    name, new_chunks = backup_store.add_snapshot(store, path, kind)
+    puts(green('Stored snapshot {0} with {1} new chunks.'.format(
+        name, new_chunks)))
+    removed_snapshots, removed_chunks = backup_store.prune_store(
+        store, getattr(settings, 'BACKUP_STORE_KEEP_LAST', 7),
+        getattr(settings, 'BACKUP_STORE_KEEP_DAILY', 30))
+    puts('Removed {0} snapshots and {1} chunks.'.format(
+        removed_snapshots, removed_chunks))
+
+
+def backup_store_restore(name=None, kind='db', filename=None, store=None):
+    """
+    Restores a snapshot from the backup store.
+
+    Database snapshots are restored as a directory format dump, media
+    snapshots as a tar archive. Afterwards they can be imported with
+    ``fab import_db`` or ``fab import_media``.
+
+    Usage::
+
+        fab backup_store_restore
+        fab backup_store_restore:kind=media
+        fab backup_store_restore:name=db-20161201-120000
+
+    :param name: The snapshot name, defaults to the latest one of ``kind``.
+    :param filename: Defaults to ``DB_DUMP_FILENAME`` or
+      ``MEDIA_DUMP_FILENAME``.
+
+    """
+    store = store or backup_store.get_store_dir()
+    if not name:
+        name = backup_store.get_latest_snapshot(
+            backup_store.list_snapshots(store, kind))
+        if not name:
+            abort(red('There are no {0} snapshots in {1}.'.format(
+                kind, store)))
+    if not filename:
+        filename = (settings.MEDIA_DUMP_FILENAME if name.startswith('media-')
+                    else settings.DB_DUMP_FILENAME)
+    _restore_snapshot(store, name, filename)
+    puts(green('Restored {0} to {1}.'.format(name, filename)))
+
+
+def coverage_merge():
+    """
+    Combines the coverage data of all test shards and writes the report.
+
+    Copy the ``.coverage.shard*`` files of all ``fab test:shard=i/n`` runs
+    into the project root first. Run ``fab check_coverage`` afterwards.
+
+    Usage::
+
+        fab coverage_merge
+
+    """
+    local('coverage combine')
+    local('coverage html -d coverage --omit="{}"'.format(
+        settings.COVERAGE_EXCLUDES))
+
+
 def check_coverage():
     """Checks if the coverage is 100%."""
     with lcd(settings.LOCAL_COVERAGE_PATH):
@@ -61,19 +615,27 @@ def check_coverage():
     print(green('Coverage is {0}%'.format(percentage)))
 
 
-def create_db(with_postgis=False):
+def create_db(with_postgis=False, template=None):
     """
     Creates the local database.
 
     :param with_postgis: If ``True``, the postgis extension will be installed.
+    :param template: Name of a database that should be used as the template
+      for the new database (see ``save_db_template``).
 
     """
     local_machine()
-    local('psql {0} -c "CREATE USER {1} WITH PASSWORD \'{2}\'"'.format(
-        USER_AND_HOST, env.db_role, DB_PASSWORD))
-    local('psql {0} -c "CREATE DATABASE {1} ENCODING \'UTF8\'"'.format(
-        USER_AND_HOST, env.db_name))
-    if with_postgis:
+    if not _psql_query("SELECT 1 FROM pg_roles WHERE rolname='{0}'".format(
+            env.db_role)):
+        local('psql {0} -c "CREATE USER {1} WITH PASSWORD \'{2}\'"'.format(
+            USER_AND_HOST, env.db_role, DB_PASSWORD))
+    if template:
+        local('psql {0} -c "CREATE DATABASE {1} TEMPLATE {2}"'.format(
+            USER_AND_HOST, env.db_name, template))
+    else:
+        local('psql {0} -c "CREATE DATABASE {1} ENCODING \'UTF8\'"'.format(
+            USER_AND_HOST, env.db_name))
+    if with_postgis and not template:
         local('psql {0} {1} -c "CREATE EXTENSION postgis"'.format(
             USER_AND_HOST, env.db_name))
     local('psql {0} -c "GRANT ALL PRIVILEGES ON DATABASE {1}'
@@ -94,7 +656,7 @@ def delete_db():
     local(' ./manage.py reset_db --router=default --noinput')
 
 
-def export_db(filename=None, remote=False):
+def export_db(filename=None, remote=False, directory=0):
     """
     Exports the database.
 
@@ -108,6 +670,11 @@ def export_db(filename=None, remote=False):
 
         fab export_db
         fab export_db:filename=foobar.dump
+        fab export_db:directory=1
+
+    :param directory: If set to 1, an uncompressed directory format dump
+      with one file per table is written (``pg_dump -Fd -Z0``). Unchanged
+      tables are then stored only once in the backup store.
 
     """
     local_machine()
@@ -118,8 +685,13 @@ def export_db(filename=None, remote=False):
     else:
         backup_dir = ''
 
-    local('pg_dump -c -Fc -O -U {0}{1} {2} -f {3}{4}'.format(
-        env.db_role, HOST, env.db_name, backup_dir, filename))
+    dump_format = '-Fc'
+    if int(directory):
+        dump_format = '-Fd -Z0'
+        # pg_dump refuses to write into an existing directory
+        local('rm -rf {0}{1}'.format(backup_dir, filename))
+    local('pg_dump -c {0} -O -U {1}{2} {3} -f {4}{5}'.format(
+        dump_format, env.db_role, HOST, env.db_name, backup_dir, filename))
 
 
 def drop_db():
@@ -134,6 +706,9 @@ def drop_db():
 
 def jshint():
     """Runs jshint checks."""
+    if _report_lint_daemon_errors('jshint'):
+        puts(green('jshint found no errors. Very good!'))
+        return
     with fab_settings(warn_only=True):
         needs_to_abort = False
         # because jshint fails with exit code 2, we need to allow this as
@@ -178,6 +753,9 @@ def jshint():
 
 def syntax_check():
     """Runs flake8 against the codebase."""
+    if _report_lint_daemon_errors('syntax_check'):
+        puts(green('Syntax check found no errors. Very good!'))
+        return
     with fab_settings(warn_only=True):
         for file_type in settings.SYNTAX_CHECK:
             needs_to_abort = False
@@ -208,9 +786,9 @@ def syntax_check():
 
 def flake8():
     """Runs flake8 against the codebase."""
-    return local(
-        'flake8 --ignore=E126,W504,W503 --max-line-length=120 --statistics'
-        ' --exclude=__pycache__,*/migrations/*,*/settings/*,*.wsgi,*.asgi .')
+    if _report_lint_daemon_errors('flake8'):
+        return
+    return local('flake8 {0} --statistics .'.format(FLAKE8_OPTIONS))
 
 
 
@@ -238,16 +816,22 @@ def import_db(filename=None):
             env.db_role, HOST, env.db_name, filename))
 
 
-def import_media(filename=None):
+def import_media(filename=None, verified=0):
     """
     Extracts media dump into your local media root.
 
     Please note that this might overwrite existing local files.
 
+    If the dump was created with ``run_export_media:verified=1``, the archive
+    is streamed straight into the media root and only files whose checksum
+    differs from the manifest are extracted. Afterwards all files are checked
+    against the manifest.
+
     Usage::
 
         fab import_media
         fab import_media:filename=foobar.tar.gz
+        fab import_media:verified=1
 
     """
     if not filename:
@@ -263,6 +847,10 @@ def import_media(filename=None):
                   ' {0}. We need a file called {1} in that folder.'.format(
                       project_root, filename)))
 
+    if int(verified):
+        _import_verified_media(os.path.join(project_root, filename))
+        return
+
     # copy the dump into the media root folder
     with lcd(project_root):
         local('cp {0} {1}'.format(filename, settings.MEDIA_ROOT))
@@ -279,6 +867,8 @@ def lessc(responsive=False):
 
     This is useful if you are using the Twitter Bootstrap Framework.
 
+    For projects with more entry points, have a look at ``build_assets``.
+
     """
     local('lessc {0}/static/css/bootstrap.less'
           ' {0}/static/css/bootstrap.css'.format(settings.PROJECT_NAME))
@@ -288,31 +878,118 @@ def lessc(responsive=False):
                   settings.PROJECT_NAME))
 
 
-def rebuild():
+def rebuild(use_template=1, profile=0):
     """
     Deletes and re-creates your DB. Needs django-extensions and South.
 
+    After a successful migrate, the database is saved as a template that is
+    keyed by a hash of all migration files. As long as no migration changes,
+    subsequent rebuilds just copy that template instead of migrating from
+    scratch.
+
+    Usage::
+
+        fab rebuild
+        fab rebuild:use_template=0
+        fab rebuild:profile=1
+
+    :param profile: If set to 1, migrate runs under cProfile. The stats are
+      saved in ``PROFILE_DIR`` and the top hotspots are printed.
+
     """
     drop_db()
-    create_db()
     if StrictVersion(django.get_version()) < StrictVersion('1.7'):
+        create_db()
         local('python{} manage.py syncdb --all --noinput'.format(
             PYTHON_VERSION))
         local('python{} manage.py migrate --fake'.format(PYTHON_VERSION))
-    else:
-        local('python{} manage.py migrate'.format(PYTHON_VERSION))
+        return
+
+    template = None
+    if int(use_template):
+        template = _get_db_template_name()
+        if _psql_query(
+                "SELECT 1 FROM pg_database WHERE datname='{0}'".format(
+                    template)):
+            create_db(template=template)
+            puts(green('Database created from template {0}.'.format(
+                template)))
+            return
+    create_db()
+    command = 'python{} manage.py migrate'.format(PYTHON_VERSION)
+    if int(profile):
+        stats_file = get_profile_path('migrate')
+        command = profile_command(command, stats_file)
+    local(command)
+    if int(profile):
+        print_profile_stats(stats_file)
+    if template:
+        save_db_template()
+
+
+def save_db_template():
+    """
+    Saves the local database as a template for ``rebuild``.
+
+    The template is named after the database and a hash of all migration
+    files. Outdated templates of the same database are dropped.
+
+    Usage::
+
+        fab save_db_template
+
+    """
+    local_machine()
+    template = _get_db_template_name()
+    outdated = _psql_query(
+        "SELECT datname FROM pg_database"
+        " WHERE datname LIKE '{0}\\_template\\_%'".format(
+            env.db_name)).split()
+    with fab_settings(warn_only=True):
+        for name in outdated:
+            local('psql {0} -c "DROP DATABASE {1}"'.format(
+                USER_AND_HOST, name))
+    local('psql {0} -c "CREATE DATABASE {1} TEMPLATE {2}"'.format(
+        USER_AND_HOST, template, env.db_name))
+
+
+def reset_passwords(password='test1234', fast=1):
+    """
+    Resets all passwords to `test1234`.
 
+    By default the password is hashed only once and written to all users
+    with a single bulk update. The hasher can be chosen via the
+    ``RESET_PASSWORDS_HASHER`` setting. Set ``fast=0`` to use
+    django-extensions' ``set_fake_passwords`` instead.
 
-def reset_passwords():
-    """Resets all passwords to `test123`."""
-    local('python{} manage.py set_fake_passwords --password=test1234'.format(
-        PYTHON_VERSION))
+    Usage::
 
+        fab reset_passwords
+        fab reset_passwords:password=foobar
+        fab reset_passwords:fast=0
 
-def test(options=None, integration=1, selenium=1, test_settings=None):
+    """
+    if not int(fast):
+        local('python{0} manage.py set_fake_passwords --password={1}'.format(
+            PYTHON_VERSION, password))
+        return
+    hasher = getattr(settings, 'RESET_PASSWORDS_HASHER', 'default')
+    # The settings module is taken from DJANGO_SETTINGS_MODULE, which the
+    # project's fabfile sets
+    local('python{0} -c "{1}"'.format(
+        PYTHON_VERSION, RESET_PASSWORDS_SCRIPT.format(password, hasher)))
+
+
+def test(options=None, integration=1, selenium=1, test_settings=None,
+         keepdb=1, ephemeral_db=0, impacted=0, shard=None,
+         record_durations=0):
     """
     Runs manage.py tests.
 
+    The test database is kept between runs. It is only re-created when the
+    migration files, the installed apps or the test settings have changed
+    since the last run.
+
     Usage::
 
         fab test
@@ -320,20 +997,92 @@ def test(options=None, integration=1, selenium=1, test_settings=None):
         fab test:app.tests.forms_tests:TestCaseName
         fab test:integration=0
         fab test:selenium=0
+        fab test:keepdb=0
+        fab test:ephemeral_db=1
+        fab test:impacted=1
+        fab test:shard=2/4
+        fab test:shard=2/4,record_durations=1
+
+    :param ephemeral_db: If set to 1, the tests run against a throwaway
+      Postgres cluster in ``EPHEMERAL_DB_DIR`` (a tmpfs by default) with
+      fsync, synchronous_commit and full_page_writes turned off. The cluster
+      is removed after the run.
+    :param impacted: If set to 1, only the tests that execute lines which
+      changed in the working tree are run. The mapping of lines to tests is
+      recorded with coverage contexts in ``TEST_IMPACT_INDEX``. If there is
+      no usable index yet, the full suite runs and records a new one.
+    :param shard: Runs only the i-th of n deterministic shards of the test
+      modules, e.g. ``2/4``. Shards are balanced by the durations in
+      ``TEST_DURATIONS_FILE`` or by the number of tests. The coverage data
+      is written to ``.coverage.shard<i>of<n>``, combine the data of all
+      shards with ``fab coverage_merge``.
+    :param record_durations: If set to 1, every test module of the shard
+      runs separately and its duration is saved to ``TEST_DURATIONS_FILE``.
 
     """
     if test_settings is None:
         test_settings = settings.TEST_SETTINGS_PATH
-    command = ("coverage run --source='.' manage.py test -v 2" +
-               " --failfast --settings={0} --pattern='*_tests.py'".format(
-                   test_settings))
-    if int(integration) == 0:
-        command += " --exclude='integration_tests'"
-    if int(selenium) == 0:
-        command += " --exclude='selenium_tests'"
-    if options:
-        command += ' {0}'.format(options)
-    with fab_settings(warn_only=True):
-        local(command, capture=False)
-    local('coverage html -d coverage --omit="{}"'.format(
-        settings.COVERAGE_EXCLUDES))
+    coverage_options = ''
+    record_impact = False
+    if int(impacted):
+        labels = impact.get_impacted_tests(TEST_PATTERN)
+        if labels == []:
+            puts(green('No tests are affected by your changes.'))
+            return
+        if labels is None:
+            warn('The test impact index is missing or stale. Running all'
+                 ' tests to record a new one.')
+            record_impact = True
+            options = None
+            rcfile = '.coveragerc_impact'
+            impact.write_rcfile(rcfile)
+            coverage_options = ' --rcfile={0}'.format(rcfile)
+        else:
+            options = ' '.join(labels)
+    coverage_file = None
+    if shard:
+        match = re.match(r'^(\d+)/(\d+)$', shard)
+        if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+            abort(red('ERROR: shard must look like i/n with 1 <= i <= n.'))
+        index, count = int(match.group(1)), int(match.group(2))
+        excludes = []
+        if int(integration) == 0:
+            excludes.append('integration_tests')
+        if int(selenium) == 0:
+            excludes.append('selenium_tests')
+        labels = sharding.get_shard(TEST_PATTERN, index, count, excludes)
+        if not labels:
+            puts(green('Shard {0} has no tests.'.format(shard)))
+            return
+        options = ' '.join(labels)
+        coverage_file = '.coverage.shard{0}of{1}'.format(index, count)
+    cluster_dir = None
+    if int(ephemeral_db):
+        keepdb = 0
+        cluster_dir, test_settings = _start_ephemeral_db(test_settings)
+    try:
+        if shard and int(record_durations):
+            if os.path.exists(coverage_file):
+                os.remove(coverage_file)
+            durations = {}
+            for label in labels:
+                start = time.time()
+                result = _run_tests(
+                    label, integration, selenium, test_settings, keepdb,
+                    coverage_options + ' -a', coverage_file, cluster_dir)
+                durations[label] = round(time.time() - start, 2)
+            sharding.save_durations(durations)
+        else:
+            result = _run_tests(options, integration, selenium,
+                                test_settings, keepdb, coverage_options,
+                                coverage_file, cluster_dir)
+    finally:
+        if cluster_dir:
+            _stop_ephemeral_db(cluster_dir)
+        if record_impact:
+            os.remove(rcfile)
+    if record_impact and result.succeeded:
+        impact.build_index()
+    if not shard:
+        local('coverage html -d coverage --omit="{}"'.format(
+            settings.COVERAGE_EXCLUDES))
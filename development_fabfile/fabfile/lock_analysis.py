@@ -0,0 +1,101 @@
+"""Helpers to estimate the lock impact of the SQL of pending migrations."""
+import re
+
+
+INSTANT = 'instant'
+SCAN = 'scan'
+REWRITE = 'rewrite'
+
+# Locks that block writes to the table while they are held
+BLOCKING_LOCKS = ('ACCESS EXCLUSIVE', 'SHARE ROW EXCLUSIVE', 'SHARE')
+
+# Rules are checked in order, the first matching rule classifies a statement
+# as ``(description, lock, cost)``.
+RULES = [
+    (r'^CREATE (UNIQUE )?INDEX CONCURRENTLY',
+     ('create index concurrently', 'SHARE UPDATE EXCLUSIVE', SCAN)),
+    (r'^CREATE (UNIQUE )?INDEX',
+     ('create index', 'SHARE', SCAN)),
+    (r'^CREATE TABLE', None),
+    (r'^ALTER TABLE .* ALTER COLUMN .* TYPE ',
+     ('change column type', 'ACCESS EXCLUSIVE', REWRITE)),
+    (r'^ALTER TABLE .* ADD COLUMN .* DEFAULT ',
+     ('add column with default', 'ACCESS EXCLUSIVE', REWRITE)),
+    (r'^ALTER TABLE .* SET NOT NULL',
+     ('set not null', 'ACCESS EXCLUSIVE', SCAN)),
+    (r'^ALTER TABLE .* FOREIGN KEY .* NOT VALID',
+     ('add foreign key (not valid)', 'SHARE ROW EXCLUSIVE', INSTANT)),
+    (r'^ALTER TABLE .* FOREIGN KEY',
+     ('add foreign key', 'SHARE ROW EXCLUSIVE', SCAN)),
+    (r'^ALTER TABLE .* ADD CONSTRAINT .* (UNIQUE|PRIMARY KEY)',
+     ('add unique constraint', 'ACCESS EXCLUSIVE', SCAN)),
+    (r'^ALTER TABLE .* ADD CONSTRAINT .* CHECK',
+     ('add check constraint', 'ACCESS EXCLUSIVE', SCAN)),
+    (r'^ALTER TABLE',
+     ('alter table', 'ACCESS EXCLUSIVE', INSTANT)),
+    (r'^(DROP TABLE|TRUNCATE)',
+     ('drop table', 'ACCESS EXCLUSIVE', INSTANT)),
+    (r'^(UPDATE|DELETE FROM)',
+     ('update rows', 'ROW EXCLUSIVE', SCAN)),
+]
+
+# Since Postgres 11 adding a column with a non-volatile default only changes
+# the catalog. Defaults with a function call are treated as volatile.
+FAST_DEFAULT_VERSION = 110000
+FAST_DEFAULT_RULE = (
+    r'^ALTER TABLE .* ADD COLUMN .* DEFAULT [^(]*$',
+    ('add column with default', 'ACCESS EXCLUSIVE', INSTANT))
+
+TABLE_PATTERN = re.compile(
+    r'(?:ALTER TABLE(?: ONLY)?|ON|UPDATE|DELETE FROM|DROP TABLE|TRUNCATE)'
+    r'\s+(?:IF EXISTS\s+)?"?([\w.]+)"?')
+
+
+def classify(sql, server_version=0):
+    """
+    Classifies every statement of the given SQL by lock level and cost.
+
+    :param sql: The output of ``manage.py sqlmigrate``.
+    :param server_version: The Postgres ``server_version_num``.
+    :returns: A list of ``(table, description, lock, cost)`` tuples. Cost is
+      one of ``instant``, ``scan`` (the table is read) or ``rewrite`` (the
+      table is written anew).
+
+    """
+    rules = RULES
+    if server_version >= FAST_DEFAULT_VERSION:
+        rules = [FAST_DEFAULT_RULE] + RULES
+    operations = []
+    statements = re.sub(r'--[^\n]*', '', sql).split(';')
+    for statement in statements:
+        statement = ' '.join(statement.split())
+        if not statement or statement.upper() in ('BEGIN', 'COMMIT'):
+            continue
+        for pattern, classification in rules:
+            if re.search(pattern, statement, re.IGNORECASE):
+                break
+        else:
+            continue
+        if classification is None:
+            continue
+        match = TABLE_PATTERN.search(statement)
+        table = match.group(1) if match else '?'
+        operations.append((table,) + classification)
+    return operations
+
+
+def estimate_seconds(cost, size, scan_rate, rewrite_rate):
+    """
+    Estimates how long an operation holds its lock.
+
+    :param size: Size of the table including indexes in bytes.
+    :param scan_rate: MB per second that can be read.
+    :param rewrite_rate: MB per second that can be rewritten.
+
+    """
+    megabytes = size / (1024.0 * 1024.0)
+    if cost == SCAN:
+        return megabytes / scan_rate
+    if cost == REWRITE:
+        return megabytes / rewrite_rate
+    return 0.0
@@ -1,14 +1,27 @@
 """Fab tasks that execute things on a remote server."""
+import glob
+import json
+import os
 import sys
+import tempfile
+import time
 
 import django
 from django.conf import settings
 
 from distutils.version import StrictVersion
-from fabric.api import cd, env, local, run
+from fabric.api import cd, env, hide, local, run
+from fabric.api import settings as fab_settings
+from fabric.colors import green, red, yellow
+from fabric.utils import abort, puts, warn
 
-from .local import drop_db, create_db, import_db, import_media, reset_passwords
-from .utils import require_server, run_workon
+from . import backup_store, loadtest, lock_analysis
+from .local import (
+    _get_artifact_dirs, _psql_query, _restore_snapshot, anonymize_db,
+    build_artifacts, drop_db, create_db, import_db, import_media,
+    reset_passwords)
+from .utils import (
+    require_server, run_local, run_parallel, run_steps, run_workon)
 
 
 if settings.PYTHON_VERSION:
@@ -21,56 +34,402 @@ if getattr(settings, 'PEM_KEY_DIR', False):
     env.key_filename = settings.PEM_KEY_DIR
 
 
+def _get_ssh_target(host_string=None):
+    """Returns the ssh alias or ``user@host`` for the given host."""
+    if env.key_filename:
+        return settings.PROJECT_NAME
+    return '{0}@{1}'.format(env.user, host_string or env.host_string)
+
+
+def _rsync_files(files, source, destination):
+    """Copies the given files (relative to ``source``) via rsync."""
+    if not files:
+        return
+    with tempfile.NamedTemporaryFile('w', delete=False) as files_from:
+        files_from.write('\n'.join(sorted(files)) + '\n')
+    try:
+        local('rsync -az --files-from={0} {1} {2}'.format(
+            files_from.name, source, destination))
+    finally:
+        os.remove(files_from.name)
+
+
+def _download_snapshot(kind, filename):
+    """
+    Downloads the latest snapshot of ``kind`` from the server's backup store.
+
+    Only chunks that are missing in the local store are transferred. The
+    snapshot is then restored to ``filename``.
+
+    """
+    ssh = _get_ssh_target()
+    remote_store = settings.FAB_SETTING('SERVER_BACKUP_STORE_DIR')
+    local_store = backup_store.get_store_dir()
+    with fab_settings(hide('everything')):
+        filenames = run('ls {0}snapshots'.format(remote_store)).split()
+    name = backup_store.get_latest_snapshot([
+        os.path.splitext(name)[0] for name in filenames
+        if name.startswith(kind + '-') and name.endswith('.json')])
+    if not name:
+        abort(red('There are no {0} snapshots on the server.'.format(kind)))
+
+    snapshot_dir = os.path.join(local_store, 'snapshots')
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    local('scp {0}:{1}snapshots/{2}.json {3}/'.format(
+        ssh, remote_store, name, snapshot_dir))
+    chunk_ids = backup_store.get_chunk_ids(
+        backup_store.load_snapshot(local_store, name))
+    missing = backup_store.get_missing_chunks(local_store, chunk_ids)
+    puts('Downloading {0} of {1} chunks of {2}.'.format(
+        len(missing), len(chunk_ids), name))
+    _rsync_files(missing, '{0}:{1}chunks/'.format(ssh, remote_store),
+                 os.path.join(local_store, 'chunks', ''))
+    _restore_snapshot(local_store, name, filename)
+    # Only the latest snapshot of every kind is needed to deduplicate the
+    # next download
+    backup_store.prune_store(local_store, 1, 0)
+
+
+def _upload_artifacts(job):
+    """
+    Uploads all artifacts that differ from the host's manifest.
+
+    :param job: A tuple of the host string and the local ``STATIC_ROOT`` of
+      the artifact build.
+
+    """
+    host_string, static_root = job
+    ssh = _get_ssh_target(host_string)
+    remote_manifest_path = settings.FAB_SETTING('SERVER_ARTIFACT_MANIFEST')
+    with open(settings.ARTIFACT_MANIFEST_FILENAME) as manifest_file:
+        manifest = json.load(manifest_file)
+    # This runs on several threads, so fabric's env must not be changed
+    result = run_local('ssh {0} cat {1}'.format(ssh, remote_manifest_path),
+                       warn_only=True)
+    remote_manifest = json.loads(result) if result else {}
+    changed = {}
+    for kind, checksums in manifest.items():
+        remote_checksums = remote_manifest.get(kind, {})
+        changed[kind] = [path for path, checksum in checksums.items()
+                         if remote_checksums.get(path) != checksum]
+    _rsync_files(changed['static'], '{0}/'.format(static_root),
+                 '{0}:{1}'.format(ssh, settings.FAB_SETTING(
+                     'SERVER_STATIC_ROOT')))
+    _rsync_files(changed['locale'], './', '{0}:{1}'.format(
+        ssh, settings.FAB_SETTING('SERVER_PROJECT_ROOT')))
+    local('scp {0} {1}:{2}'.format(
+        settings.ARTIFACT_MANIFEST_FILENAME, ssh, remote_manifest_path))
+    return host_string, sum(len(paths) for paths in changed.values())
+
+
+@require_server
+def run_analyze_migrations(force=0):
+    """
+    Estimates the lock impact of the pending migrations on the server.
+
+    The SQL of every pending migration is classified by the lock it takes
+    and whether it scans or rewrites the table. The migrations are read from
+    the git checkout on the server, so run this after ``run_git_pull`` and
+    before ``run_rsync_project``. Durations are estimated from the table
+    sizes and the Postgres version of your local database, so import a
+    recent copy with ``fab <server> import_remote_db`` first.
+
+    Operations that block writes for longer than
+    ``MIGRATION_LOCK_WARN_SECONDS`` are reported, if they block for longer
+    than ``MIGRATION_LOCK_ABORT_SECONDS`` the task aborts.
+
+    Usage::
+
+        fab <server> run_analyze_migrations
+        fab <server> run_analyze_migrations:force=1
+
+    :param force: If set to 1, the task never aborts.
+
+    """
+    # The git checkout already has the new code before run_rsync_project
+    # copies it to the live project root
+    project_root = settings.FAB_SETTING('SERVER_REPO_PROJECT_ROOT')
+    plan = run_workon('python{} manage.py showmigrations --plan'.format(
+        PYTHON_VERSION), cwd=project_root)
+    pending = [line.split()[-1] for line in plan.splitlines()
+               if line.strip().startswith('[ ]')]
+    if not pending:
+        puts(green('There are no pending migrations.'))
+        return
+    commands = [
+        'echo "-- MIGRATION {0}" && python{1} manage.py sqlmigrate {2} {3}'
+        .format(migration, PYTHON_VERSION, *migration.split('.', 1))
+        for migration in pending]
+    output = run_workon(' && '.join(commands), cwd=project_root)
+
+    sizes = {}
+    for line in _psql_query(
+            "SELECT relname, pg_total_relation_size(oid) FROM pg_class"
+            " WHERE relkind = 'r'",
+            settings.DATABASES['default']['NAME']).splitlines():
+        table, size = line.split('|')
+        sizes[table] = int(size)
+    server_version = int(_psql_query('SHOW server_version_num'))
+
+    scan_rate = getattr(settings, 'MIGRATION_SCAN_MB_PER_SECOND', 200)
+    rewrite_rate = getattr(settings, 'MIGRATION_REWRITE_MB_PER_SECOND', 50)
+    warn_seconds = getattr(settings, 'MIGRATION_LOCK_WARN_SECONDS', 1)
+    abort_seconds = getattr(settings, 'MIGRATION_LOCK_ABORT_SECONDS', 30)
+    needs_to_abort = False
+    for migration_sql in output.split('-- MIGRATION ')[1:]:
+        migration, sql = migration_sql.split('\n', 1)
+        puts(migration.strip())
+        for table, description, lock, cost in lock_analysis.classify(
+                sql, server_version):
+            seconds = lock_analysis.estimate_seconds(
+                cost, sizes.get(table, 0), scan_rate, rewrite_rate)
+            message = '    {0:<30} {1:<28} {2:<24} {3:<8} ~{4:.1f}s'.format(
+                table, description, lock, cost, seconds)
+            if lock not in lock_analysis.BLOCKING_LOCKS:
+                puts(message)
+            elif seconds > abort_seconds:
+                puts(red(message))
+                needs_to_abort = True
+            elif seconds > warn_seconds:
+                warn(yellow(message))
+            else:
+                puts(message)
+    if needs_to_abort and not int(force):
+        abort(red('Some migrations would block writes for more than {0}s.'
+                  ' Run with force=1 to deploy them anyway.'.format(
+                      abort_seconds)))
+
+
+@require_server
+def run_backup_db():
+    """
+    Exports the database on the server and adds it to the backup store.
+
+    The dump is an uncompressed directory format dump with one file per
+    table, so unchanged tables are stored only once. Storing costs about as
+    much CPU time as reading the dump and compressing the changed tables
+    with ``gzip -1``. Old snapshots are removed according to
+    ``BACKUP_STORE_KEEP_LAST`` and ``BACKUP_STORE_KEEP_DAILY``.
+
+    Backups are only stored when this task is called, e.g. from a cron job.
+    To download and import the latest snapshot, run
+    ``fab prod run_download_db:from_store=1 import_db``.
+
+    Usage::
+
+        fab prod run_backup_db
+
+    """
+    # A separate path leaves the dump of ``run_export_db`` untouched
+    filename = '{0}.store'.format(settings.DB_DUMP_FILENAME)
+    run_export_db(filename=filename, directory=1)
+    path = '{0}{1}'.format(
+        settings.FAB_SETTING('SERVER_DB_BACKUP_DIR'), filename)
+    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
+        run_workon('fab backup_store_add:path={0},kind=db,store={1}'.format(
+            path, settings.FAB_SETTING('SERVER_BACKUP_STORE_DIR')))
+    run('rm -rf {0}'.format(path))
+
+
+@require_server
+def run_backup_media():
+    """
+    Adds the media folder on the server to the backup store.
+
+    Every file is stored separately, so unchanged files are only hashed and
+    not stored again. Old snapshots are removed according to
+    ``BACKUP_STORE_KEEP_LAST`` and ``BACKUP_STORE_KEEP_DAILY``.
+
+    Backups are only stored when this task is called, e.g. from a cron job.
+    To download and import the latest snapshot, run
+    ``fab prod run_download_media:from_store=1 import_media``.
+
+    Usage::
+
+        fab prod run_backup_media
+
+    """
+    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
+        run_workon(
+            'fab backup_store_add:path={0},kind=media,store={1}'.format(
+                settings.FAB_SETTING('SERVER_MEDIA_ROOT'),
+                settings.FAB_SETTING('SERVER_BACKUP_STORE_DIR')))
+
+
+@require_server
+def run_benchmark(base_url=None, duration=None, concurrency=None):
+    """
+    Runs a HTTP load benchmark against the given server.
+
+    The URLs in ``BENCHMARK_URLS`` are requested in turn by
+    ``BENCHMARK_CONCURRENCY`` threads for ``BENCHMARK_DURATION`` seconds.
+    Throughput, latency percentiles and a latency histogram are printed and
+    saved together with the deployed git revision in
+    ``BENCHMARK_RESULTS_DIR``. The results are compared with the previous
+    benchmark of the same server.
+
+    Usage::
+
+        fab <server> run_benchmark
+        fab <server> run_benchmark:duration=60,concurrency=20
+        fab local_machine run_benchmark:base_url=http://localhost:8000
+
+    :param base_url: Overrides the ``SERVER_BASE_URL`` of the server.
+
+    """
+    if not base_url:
+        base_url = (settings.FAB_SETTING('SERVER_BASE_URL') or
+                    'http://{0}'.format(env.host_string))
+    if not duration:
+        duration = getattr(settings, 'BENCHMARK_DURATION', 30)
+    if not concurrency:
+        concurrency = getattr(settings, 'BENCHMARK_CONCURRENCY', 10)
+    urls = [base_url + path
+            for path in getattr(settings, 'BENCHMARK_URLS', [''])]
+    results_dir = getattr(settings, 'BENCHMARK_RESULTS_DIR', 'benchmarks')
+
+    with fab_settings(hide('everything'), warn_only=True):
+        if env.machine == 'local':
+            revision = local('git rev-parse HEAD', capture=True)
+        else:
+            revision = run('cd {0} && git rev-parse HEAD'.format(
+                settings.FAB_SETTING('SERVER_REPO_ROOT')))
+
+    latencies, errors, elapsed = loadtest.run_load(
+        urls, int(concurrency), float(duration))
+    result = loadtest.summarize(latencies, errors, elapsed)
+    result.update({'machine': env.machine, 'base_url': base_url,
+                   'revision': revision.strip(), 'date': time.time()})
+
+    previous_files = sorted(glob.glob(os.path.join(
+        results_dir, '{0}-*.json'.format(env.machine))))
+    previous = None
+    if previous_files:
+        with open(previous_files[-1]) as previous_file:
+            previous = json.load(previous_file)
+
+    puts('{0} requests, {1} errors, {2} requests/s'.format(
+        result['requests'], errors, result['throughput']))
+    for key in ('throughput', 'p50', 'p95', 'p99'):
+        line = '{0:<12} {1:>10}'.format(key, result[key])
+        if previous and previous[key]:
+            change = (result[key] - previous[key]) * 100.0 / previous[key]
+            line += '  ({0:+.1f}% since {1})'.format(
+                change, previous['revision'][:8])
+        puts(line)
+    total = max(1, len(latencies))
+    for bound, count in result['histogram']:
+        label = '<= {0}ms'.format(bound) if bound else '> {0}ms'.format(
+            loadtest.HISTOGRAM_BUCKETS[-1])
+        puts('{0:>10} {1:>7} {2}'.format(
+            label, count, '#' * int(round(50.0 * count / total))))
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    filename = os.path.join(results_dir, '{0}-{1}.json'.format(
+        env.machine, time.strftime('%Y%m%d-%H%M%S')))
+    with open(filename, 'w') as result_file:
+        json.dump(result, result_file, indent=1, sort_keys=True)
+    puts(green('Saved results to {0}'.format(filename)))
+
+
 @require_server
-def run_collectstatic():
+def run_collectstatic(profile=0):
     """
     Runs `./manage.py collectstatic` on the given server.
 
     Usage::
 
         fab <server> run_collectstatic
+        fab <server> run_collectstatic:profile=1
+
+    :param profile: If set to 1, the command runs under cProfile and the
+      top hotspots are printed (see ``utils.run_workon``).
 
     """
-    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
-        run_workon('python{} manage.py collectstatic --noinput'.format(
-            PYTHON_VERSION))
+    run_workon('python{} manage.py collectstatic --noinput'.format(
+        PYTHON_VERSION), cwd=settings.FAB_SETTING('SERVER_PROJECT_ROOT'),
+        profile=int(profile))
 
 
 @require_server
-def run_compilemessages():
+def run_compilemessages(profile=0):
     """
     Executes ./manage.py compilemessages on the server.
 
     Usage::
 
         fab <server name> run_compilemessages
+        fab <server name> run_compilemessages:profile=1
+
+    :param profile: If set to 1, the command runs under cProfile and the
+      top hotspots are printed (see ``utils.run_workon``).
 
     """
 
-    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
-        run_workon('python{} manage.py compilemessages'.format(PYTHON_VERSION))
+    run_workon('python{} manage.py compilemessages'.format(PYTHON_VERSION),
+               cwd=settings.FAB_SETTING('SERVER_PROJECT_ROOT'),
+               profile=int(profile))
 
 
 @require_server
 def run_deploy_website(restart_apache=False, restart_uwsgi=False,
-                       restart_nginx=False):
+                       restart_nginx=False, parallel=1, artifacts=0,
+                       analyze_migrations=0, warmup=0):
     """
     Executes all tasks necessary to deploy the website on the given server.
 
+    Steps that don't depend on each other run concurrently on the server
+    and a timing breakdown is printed at the end. ``migrate`` and
+    ``collectstatic`` wait for ``pip install`` and ``rsync``, messages are
+    compiled after they have been made.
+
     Usage::
 
         fab <server> run_deploy_website
-
-    """
-    run_git_pull()
-    run_pip_install()
-    run_rsync_project()
-    run_syncdb()
-    run_collectstatic()
+        fab <server> run_deploy_website:parallel=0
+        fab <server> run_deploy_website:artifacts=1
+        fab <server> run_deploy_website:analyze_migrations=1
+        fab <server> run_deploy_website:warmup=1
+
+    :param parallel: If set to 0, all steps run one after another.
+    :param artifacts: If set to 1, static files and messages are built
+      locally while the server pulls the code and are then uploaded (see
+      ``build_artifacts`` and ``run_upload_artifacts``) instead of running
+      collectstatic and compilemessages on the server.
+    :param analyze_migrations: If set to 1, ``run_analyze_migrations`` runs
+      before the new code is copied to the project root and can abort the
+      deployment.
+    :param warmup: If set to 1, ``run_warmup`` runs after the restart.
+
+    """
+    installed = ['pip_install', 'rsync_project']
+    steps = [
+        ('git_pull', run_git_pull, []),
+        ('pip_install', run_pip_install, ['git_pull']),
+        ('rsync_project',
+         lambda: run_rsync_project(exclude_artifacts=artifacts),
+         ['git_pull', 'analyze_migrations']),
+        ('syncdb', run_syncdb, installed),
+    ]
+    if int(analyze_migrations):
+        steps.append(('analyze_migrations', run_analyze_migrations,
+                      ['git_pull', 'pip_install']))
     if getattr(settings, 'MAKEMESSAGES_ON_DEPLOYMENT', False):
-        run_makemessages()
-    if getattr(settings, 'COMPILEMESSAGES_ON_DEPLOYMENT', False):
-        run_compilemessages()
+        steps.append(('makemessages', run_makemessages, installed))
+    if int(artifacts):
+        steps += [
+            ('build_artifacts', build_artifacts, []),
+            ('upload_artifacts', run_upload_artifacts,
+             ['build_artifacts', 'rsync_project']),
+        ]
+    else:
+        steps.append(('collectstatic', run_collectstatic, installed))
+        if getattr(settings, 'COMPILEMESSAGES_ON_DEPLOYMENT', False):
+            steps.append(('compilemessages', run_compilemessages,
+                          installed + ['makemessages']))
+    run_steps(steps, parallel=int(parallel))
     if restart_apache:
         run_restart_apache()
     if restart_uwsgi:
@@ -79,10 +438,12 @@ def run_deploy_website(restart_apache=False, restart_uwsgi=False,
         run_restart_nginx()
     else:
         run_touch_wsgi()
+    if int(warmup):
+        run_warmup()
 
 
 @require_server
-def run_download_db(filename=None):
+def run_download_db(filename=None, from_store=0):
     """
     Downloads the database from the server into your local machine.
 
@@ -92,20 +453,25 @@ def run_download_db(filename=None):
 
         fab prod run_download_db
         fab prod run_download_db:filename=foobar.dump
+        fab prod run_download_db:from_store=1
+
+    :param from_store: If set to 1, the latest snapshot of
+      ``run_backup_db`` is downloaded. Only chunks that are not in the local
+      backup store yet are transferred.
 
     """
     if not filename:
         filename = settings.DB_DUMP_FILENAME
-    if env.key_filename:
-        ssh = settings.PROJECT_NAME
-    else:
-        ssh = '{0}@{1}'.format(env.user, env.host_string)
+    if int(from_store):
+        _download_snapshot('db', filename)
+        return
+    ssh = _get_ssh_target()
     local('scp {0}:{1}{2} .'.format(
         ssh, settings.FAB_SETTING('SERVER_DB_BACKUP_DIR'), filename))
 
 
 @require_server
-def run_download_media(filename=None):
+def run_download_media(filename=None, verified=0, from_store=0):
     """
     Downloads the media dump from the server into your local machine.
 
@@ -115,20 +481,31 @@ def run_download_media(filename=None):
 
         fab prod run_download_media
         fab prod run_download_media:filename=foobar.tar.gz
+        fab prod run_download_media:verified=1
+        fab prod run_download_media:from_store=1
+
+    :param verified: If set to 1, the checksum manifest that was created by
+      ``run_export_media:verified=1`` is downloaded as well.
+    :param from_store: If set to 1, the latest snapshot of
+      ``run_backup_media`` is downloaded. Only chunks that are not in the
+      local backup store yet are transferred.
 
     """
     if not filename:
         filename = settings.MEDIA_DUMP_FILENAME
-    if env.key_filename:
-        ssh = settings.PROJECT_NAME
-    else:
-        ssh = '{0}@{1}'.format(env.user, env.host_string)
+    if int(from_store):
+        _download_snapshot('media', filename)
+        return
+    ssh = _get_ssh_target()
     local('scp {0}:{1}{2} .'.format(
         ssh, settings.FAB_SETTING('SERVER_MEDIA_BACKUP_DIR'), filename))
+    if int(verified):
+        local('scp {0}:{1}{2}.sha1 .'.format(
+            ssh, settings.FAB_SETTING('SERVER_MEDIA_BACKUP_DIR'), filename))
 
 
 @require_server
-def run_export_db(filename=None):
+def run_export_db(filename=None, directory=0):
     """
     Exports the database on the server.
 
@@ -137,15 +514,20 @@ def run_export_db(filename=None):
         fab prod run_export_db
         fab prod run_export_db:filename=foobar.dump
 
+    :param directory: If set to 1, a directory format dump is written (see
+      ``export_db``).
+
     """
     if not filename:
         filename = settings.DB_DUMP_FILENAME
     with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
-        run_workon('fab export_db:remote=True,filename={}'.format(filename))
+        run_workon(
+            'fab export_db:remote=True,filename={0},directory={1}'.format(
+                filename, directory))
 
 
 @require_server
-def run_export_media(filename=None):
+def run_export_media(filename=None, verified=0):
     """
     Exports the media folder on the server.
 
@@ -153,6 +535,11 @@ def run_export_media(filename=None):
 
         fab prod run_export_media
         fab prod run_export_media:filename=foobar.tar.gz
+        fab prod run_export_media:verified=1
+
+    :param verified: If set to 1, the archive is compressed with ``pigz``
+      (when installed) and a ``<filename>.sha1`` manifest with the checksum
+      of every file is written next to it.
 
     """
     if not filename:
@@ -160,6 +547,13 @@ def run_export_media(filename=None):
 
     with cd(settings.FAB_SETTING('SERVER_MEDIA_ROOT')):
         run('rm -rf {0}'.format(filename))
+        if int(verified):
+            backup_dir = settings.FAB_SETTING('SERVER_MEDIA_BACKUP_DIR')
+            run('find . -type f -print0 | xargs -0 -r sha1sum'
+                ' > {0}{1}.sha1'.format(backup_dir, filename))
+            run('tar -cf - . | $(command -v pigz || echo gzip)'
+                ' > {0}{1}'.format(backup_dir, filename))
+            return
         run('tar -czf {0} *'.format(filename))
         run('mv {0} {1}'.format(
             filename, settings.FAB_SETTING('SERVER_MEDIA_BACKUP_DIR')))
@@ -175,8 +569,8 @@ def run_git_pull():
         fab <server> run_git_pull
 
     """
-    with cd(settings.FAB_SETTING('SERVER_REPO_ROOT')):
-        run('git pull && git submodule init && git submodule update')
+    run('cd {0} && git pull && git submodule init && git submodule update'
+        .format(settings.FAB_SETTING('SERVER_REPO_ROOT')))
 
 
 @require_server
@@ -190,33 +584,44 @@ def import_remote_db():
     drop_db()
     create_db()
     import_db()
+    if getattr(settings, 'ANONYMIZE_FIELDS', None):
+        anonymize_db()
     reset_passwords()
 
 
 @require_server
-def import_remote_media():
+def import_remote_media(verified=0):
     """
     Downloads media and imports it locally.
 
+    Usage::
+
+        fab prod import_remote_media
+        fab prod import_remote_media:verified=1
+
     """
-    run_export_media()
-    run_download_media()
-    import_media()
+    run_export_media(verified=verified)
+    run_download_media(verified=verified)
+    import_media(verified=verified)
 
 
 @require_server
-def run_makemessages():
+def run_makemessages(profile=0):
     """
     Executes ./manage.py makemessages -s --all on the server.
 
     Usage::
 
         fab <server name> run_makemessages
+        fab <server name> run_makemessages:profile=1
+
+    :param profile: If set to 1, the command runs under cProfile and the
+      top hotspots are printed (see ``utils.run_workon``).
 
     """
-    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
-        run_workon('python{} manage.py makemessages -s --all'.format(
-            PYTHON_VERSION))
+    run_workon('python{} manage.py makemessages -s --all'.format(
+        PYTHON_VERSION), cwd=settings.FAB_SETTING('SERVER_PROJECT_ROOT'),
+        profile=int(profile))
 
 
 @require_server
@@ -284,7 +689,7 @@ def run_restart_nginx():
 
 
 @require_server
-def run_rsync_project():
+def run_rsync_project(exclude_artifacts=0):
     """
     Copies the project from the git repository to it's destination folder.
 
@@ -295,10 +700,17 @@ def run_rsync_project():
     Usage::
 
         fab <server> run_rsync_project
+        fab <server> run_rsync_project:exclude_artifacts=1
+
+    :param exclude_artifacts: If set to 1, compiled messages that have been
+      uploaded by ``run_upload_artifacts`` are not deleted.
 
     """
     excludes = ''
-    for exclude in settings.RSYNC_EXCLUDES:
+    rsync_excludes = list(settings.RSYNC_EXCLUDES)
+    if int(exclude_artifacts):
+        rsync_excludes.append('*.mo')
+    for exclude in rsync_excludes:
         excludes += " --exclude '{0}'".format(exclude)
     command = "rsync -avz --stats --delete {0} {1} {2}".format(
         excludes, settings.FAB_SETTING('SERVER_REPO_PROJECT_ROOT'),
@@ -307,21 +719,26 @@ def run_rsync_project():
 
 
 @require_server
-def run_syncdb():
+def run_syncdb(profile=0):
     """
     Runs `./manage.py syncdb --migrate` on the given server.
 
     Usage::
 
         fab <server> run_syncdb
+        fab <server> run_syncdb:profile=1
+
+    :param profile: If set to 1, the command runs under cProfile and the
+      top hotspots are printed (see ``utils.run_workon``).
 
     """
-    with cd(settings.FAB_SETTING('SERVER_PROJECT_ROOT')):
-        if StrictVersion(django.get_version()) < StrictVersion('1.7'):
-            run_workon('python{} manage.py syncdb --migrate --noinput'.format(
-                PYTHON_VERSION))
-        else:
-            run_workon('python{} manage.py migrate'.format(PYTHON_VERSION))
+    project_root = settings.FAB_SETTING('SERVER_PROJECT_ROOT')
+    if StrictVersion(django.get_version()) < StrictVersion('1.7'):
+        run_workon('python{} manage.py syncdb --migrate --noinput'.format(
+            PYTHON_VERSION), cwd=project_root, profile=int(profile))
+    else:
+        run_workon('python{} manage.py migrate'.format(PYTHON_VERSION),
+                   cwd=project_root, profile=int(profile))
 
 
 @require_server
@@ -337,6 +754,63 @@ def run_touch_wsgi():
     run('touch {0}'.format(settings.FAB_SETTING('SERVER_WSGI_FILE')))
 
 
+@require_server
+def run_warmup():
+    """
+    Warms up the workers of the given server after a deployment.
+
+    Every URL in ``WARMUP_URLS`` is requested ``WARMUP_REQUESTS_PER_URL``
+    times, ``WARMUP_CONCURRENCY`` requests at a time, so that every worker
+    gets some of them. This is repeated until all requests succeed and the
+    95th percentile latency is below ``WARMUP_P95_MS``.
+
+    Usage::
+
+        fab <server> run_warmup
+
+    """
+    base_url = (settings.FAB_SETTING('SERVER_BASE_URL') or
+                'http://{0}'.format(env.host_string))
+    urls = [base_url + path for path in getattr(settings, 'WARMUP_URLS', [''])]
+    urls *= getattr(settings, 'WARMUP_REQUESTS_PER_URL', 8)
+    concurrency = getattr(settings, 'WARMUP_CONCURRENCY', 8)
+    threshold = getattr(settings, 'WARMUP_P95_MS', 500)
+    rounds = getattr(settings, 'WARMUP_MAX_ROUNDS', 10)
+    for round_number in range(1, rounds + 1):
+        latencies, errors = loadtest.run_requests(urls, concurrency)
+        p95 = loadtest.percentile(latencies, 95) * 1000
+        puts('Warm-up round {0}: p95 {1:.0f}ms, {2} errors'.format(
+            round_number, p95, errors))
+        if not errors and p95 <= threshold:
+            puts(green('Workers are warmed up.'))
+            return
+    abort(red('p95 latency did not settle below {0}ms after {1}'
+              ' rounds.'.format(threshold, rounds)))
+
+
+@require_server
+def run_upload_artifacts():
+    """
+    Uploads locally built static files and compiled messages to the servers.
+
+    Run ``fab build_artifacts`` first. Only files whose checksum differs from
+    the manifest that was uploaded last time are transferred. All hosts are
+    handled in parallel.
+
+    Usage::
+
+        fab <server> run_upload_artifacts
+
+    """
+    hosts = env.hosts or [env.host_string]
+    static_root = _get_artifact_dirs()[0]
+    for host_string, count in run_parallel(
+            _upload_artifacts, [(host, static_root) for host in hosts],
+            len(hosts)):
+        puts(green('Uploaded {0} changed artifacts to {1}.'.format(
+            count, host_string)))
+
+
 @require_server
 def run_upload_db(filename=None):
     """
@@ -355,9 +829,6 @@ def run_upload_db(filename=None):
     """
     if not filename:
         filename = settings.DB_DUMP_FILENAME
-    if env.key_filename:
-        ssh = settings.PROJECT_NAME
-    else:
-        ssh = '{0}@{1}'.format(env.user, env.host_string)
-    local('scp {0} {1}:{3}'.format(
+    ssh = _get_ssh_target()
+    local('scp {0} {1}:{2}'.format(
         filename, ssh, settings.FAB_SETTING('SERVER_DB_BACKUP_DIR')))
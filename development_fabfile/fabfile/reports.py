@@ -0,0 +1,207 @@
+"""Fab tasks that report on the performance of the local database."""
+import json
+import os
+import time
+
+from django.conf import settings
+
+from fabric.colors import green, yellow
+from fabric.state import env
+from fabric.utils import puts
+
+from .local import _psql_query
+from .servers import local_machine
+
+
+TABLES_QUERY = (
+    "SELECT relname AS table_name,"
+    " pg_total_relation_size(relid) AS total_bytes,"
+    " pg_relation_size(relid) AS table_bytes,"
+    " pg_indexes_size(relid) AS index_bytes,"
+    " n_live_tup AS live_rows, n_dead_tup AS dead_rows,"
+    " round(100.0 * n_dead_tup / greatest(n_live_tup + n_dead_tup, 1), 1)"
+    " AS dead_percent"
+    " FROM pg_stat_user_tables ORDER BY total_bytes DESC")
+
+INDEXES_QUERY = (
+    "SELECT s.relname AS table_name, s.indexrelname AS index_name,"
+    " pg_relation_size(s.indexrelid) AS bytes, s.idx_scan AS scans,"
+    " i.indisunique AS is_unique, i.indisprimary AS is_primary"
+    " FROM pg_stat_user_indexes s"
+    " JOIN pg_index i ON i.indexrelid = s.indexrelid"
+    " ORDER BY bytes DESC")
+
+DUPLICATE_INDEXES_QUERY = (
+    "SELECT i.indrelid::regclass::text AS table_name,"
+    " array_agg(i.indexrelid::regclass::text) AS indexes,"
+    " sum(pg_relation_size(i.indexrelid)) AS bytes"
+    " FROM pg_index i JOIN pg_class c ON c.oid = i.indrelid"
+    " JOIN pg_namespace n ON n.oid = c.relnamespace"
+    " WHERE n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')"
+    " GROUP BY i.indrelid, i.indkey::text, i.indclass::text,"
+    " coalesce(i.indexprs::text, ''), coalesce(i.indpred::text, '')"
+    " HAVING count(*) > 1")
+
+UNINDEXED_FOREIGN_KEYS_QUERY = (
+    "SELECT c.conrelid::regclass::text AS table_name,"
+    " c.conname AS constraint_name,"
+    " pg_get_constraintdef(c.oid) AS definition"
+    " FROM pg_constraint c WHERE c.contype = 'f' AND NOT EXISTS ("
+    " SELECT 1 FROM pg_index i WHERE i.indrelid = c.conrelid"
+    " AND (i.indkey::int2[])[0:array_length(c.conkey, 1) - 1] @> c.conkey)"
+    " ORDER BY table_name")
+
+STATEMENTS_QUERY = (
+    "SELECT left(regexp_replace(query, '\\s+', ' ', 'g'), 200) AS query,"
+    " calls, round({0}::numeric, 1) AS total_ms,"
+    " round(({0} / calls)::numeric, 2) AS mean_ms, rows"
+    " FROM pg_stat_statements ORDER BY {0} DESC LIMIT {1}")
+
+STATS_RESET_QUERY = (
+    "SELECT coalesce(stats_reset::text, '') FROM pg_stat_database"
+    " WHERE datname = current_database()")
+
+
+def _get_rows(query, warn_only=False):
+    """
+    Runs the query against the local database and returns its rows.
+
+    :param warn_only: If ``True``, ``None`` is returned if the query fails.
+
+    """
+    result = _psql_query(
+        "SELECT coalesce(json_agg(t), '[]') FROM ({0}) t".format(query),
+        env.db_name, warn_only=warn_only)
+    return None if result is None else json.loads(result)
+
+
+def _format_bytes(size):
+    """Returns the given number of bytes in a human readable form."""
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1024:
+            return '{0:.0f}{1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f}TB'.format(size)
+
+
+def _get_top_statements():
+    """
+    Returns the top queries if ``pg_stat_statements`` is available.
+
+    The extension can be installed without being loaded through
+    ``shared_preload_libraries``. Then querying it fails and ``None`` is
+    returned as well.
+
+    """
+    if not _psql_query(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'",
+            env.db_name):
+        return None
+    column = 'total_time'
+    if _psql_query(
+            "SELECT 1 FROM information_schema.columns"
+            " WHERE table_name = 'pg_stat_statements'"
+            " AND column_name = 'total_exec_time'", env.db_name):
+        column = 'total_exec_time'
+    return _get_rows(STATEMENTS_QUERY.format(
+        column, getattr(settings, 'DB_REPORT_TOP_QUERIES', 20)),
+        warn_only=True)
+
+
+def db_report():
+    """
+    Reports table and index sizes and common index problems.
+
+    The report covers table and index sizes, dead rows as a bloat estimate,
+    unused and duplicate indexes and foreign keys without an index. If the
+    ``pg_stat_statements`` extension is available, the queries with the
+    highest total time are listed as well.
+
+    Index usage is counted since the statistics were last reset. A freshly
+    imported database (e.g. after ``import_remote_db``) has not scanned
+    any index yet, so no indexes are reported as unused then.
+
+    Besides the text output, the report is saved as JSON in
+    ``DB_REPORT_DIR`` so that it can be compared over time.
+
+    Usage::
+
+        fab db_report
+
+    """
+    local_machine()
+    indexes = _get_rows(INDEXES_QUERY)
+    # Without a single index scan the statistics are empty, e.g. right
+    # after a restore, and every index would look unused
+    has_index_stats = any(index['scans'] for index in indexes)
+    report = {
+        'database': env.db_name,
+        'date': time.time(),
+        'stats_reset': _psql_query(STATS_RESET_QUERY, env.db_name) or None,
+        'tables': _get_rows(TABLES_QUERY),
+        'unused_indexes': [
+            index for index in indexes
+            if not index['scans'] and not index['is_unique'] and
+            not index['is_primary']] if has_index_stats else None,
+        'duplicate_indexes': _get_rows(DUPLICATE_INDEXES_QUERY),
+        'unindexed_foreign_keys': _get_rows(UNINDEXED_FOREIGN_KEYS_QUERY),
+        'top_statements': _get_top_statements(),
+    }
+
+    puts('Statistics collected since {0}'.format(
+        report['stats_reset'] or 'the database was created'))
+
+    puts(green('\nTables'))
+    puts('{0:<40} {1:>9} {2:>9} {3:>9} {4:>12} {5:>7}'.format(
+        'table', 'total', 'table', 'indexes', 'rows', 'dead %'))
+    for table in report['tables']:
+        puts('{0:<40} {1:>9} {2:>9} {3:>9} {4:>12} {5:>7}'.format(
+            table['table_name'], _format_bytes(table['total_bytes']),
+            _format_bytes(table['table_bytes']),
+            _format_bytes(table['index_bytes']), table['live_rows'],
+            table['dead_percent']))
+
+    puts(green('\nIndexes'))
+    for index in indexes:
+        puts('{0:<40} {1:<40} {2:>9} {3:>10} scans'.format(
+            index['table_name'], index['index_name'],
+            _format_bytes(index['bytes']), index['scans']))
+
+    puts(green('\nUnused indexes'))
+    if report['unused_indexes'] is None:
+        puts(yellow('No index has been scanned since the statistics were'
+                    ' reset, e.g. because the database was just imported.'
+                    ' Unused indexes can not be determined.'))
+    for index in report['unused_indexes'] or []:
+        puts(yellow('{0:<40} {1:<40} {2:>9}'.format(
+            index['table_name'], index['index_name'],
+            _format_bytes(index['bytes']))))
+
+    puts(green('\nDuplicate indexes'))
+    for duplicate in report['duplicate_indexes']:
+        puts(yellow('{0:<40} {1} ({2})'.format(
+            duplicate['table_name'], ', '.join(duplicate['indexes']),
+            _format_bytes(duplicate['bytes']))))
+
+    puts(green('\nForeign keys without an index'))
+    for foreign_key in report['unindexed_foreign_keys']:
+        puts(yellow('{0:<40} {1}'.format(
+            foreign_key['table_name'], foreign_key['definition'])))
+
+    puts(green('\nTop queries by total time'))
+    if report['top_statements'] is None:
+        puts('pg_stat_statements is not installed or not loaded through'
+             ' shared_preload_libraries.')
+    for statement in report['top_statements'] or []:
+        puts('{0:>12}ms {1:>10}x {2:>10}ms  {3}'.format(
+            statement['total_ms'], statement['calls'], statement['mean_ms'],
+            statement['query']))
+
+    report_dir = getattr(settings, 'DB_REPORT_DIR', 'db_reports')
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    filename = os.path.join(report_dir, '{0}-{1}.json'.format(
+        env.db_name, time.strftime('%Y%m%d-%H%M%S')))
+    with open(filename, 'w') as report_file:
+        json.dump(report, report_file, indent=1, sort_keys=True)
+    puts(green('\nSaved report to {0}'.format(filename)))
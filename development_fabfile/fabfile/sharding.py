@@ -0,0 +1,98 @@
+"""Helpers to split the test suite into deterministic shards."""
+import fnmatch
+import json
+import os
+import re
+
+from django.conf import settings
+
+
+TEST_METHOD_PATTERN = re.compile(r'^\s*def test', re.MULTILINE)
+
+
+def get_durations_path():
+    """Returns the path of the file with the recorded test durations."""
+    return getattr(settings, 'TEST_DURATIONS_FILE', '.test_durations.json')
+
+
+def load_durations():
+    """Returns the recorded durations as ``{label: seconds}``."""
+    try:
+        with open(get_durations_path()) as durations_file:
+            return json.load(durations_file)
+    except IOError:
+        return {}
+
+
+def save_durations(durations):
+    """Merges the given durations into the durations file."""
+    recorded = load_durations()
+    recorded.update(durations)
+    with open(get_durations_path(), 'w') as durations_file:
+        json.dump(recorded, durations_file, indent=1, sort_keys=True)
+
+
+def discover_labels(pattern, excludes=()):
+    """
+    Returns the labels and number of tests of all test modules.
+
+    :param pattern: The pattern of test module file names.
+    :param excludes: Labels that contain any of these strings are skipped.
+    :returns: A dict ``{label: number of test methods}``.
+
+    """
+    labels = {}
+    for directory, dirnames, filenames in os.walk('.'):
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if not name.startswith('.') and name != 'node_modules')
+        for filename in fnmatch.filter(filenames, pattern):
+            path = os.path.relpath(os.path.join(directory, filename))
+            label = os.path.splitext(path)[0].replace(os.sep, '.')
+            if any(exclude in label for exclude in excludes):
+                continue
+            with open(path) as test_file:
+                labels[label] = len(
+                    TEST_METHOD_PATTERN.findall(test_file.read()))
+    return labels
+
+
+def partition(weights, count):
+    """
+    Splits the given labels into ``count`` shards of similar total weight.
+
+    The heaviest labels are assigned first, each to the currently lightest
+    shard. Ties are broken by label and shard index, so every machine
+    computes the same partition.
+
+    :param weights: A dict ``{label: weight}``.
+    :param count: The number of shards.
+    :returns: A list of ``count`` sorted lists of labels.
+
+    """
+    shards = [[] for index in range(count)]
+    totals = [0] * count
+    for label in sorted(weights, key=lambda label: (-weights[label], label)):
+        index = totals.index(min(totals))
+        shards[index].append(label)
+        totals[index] += weights[label]
+    return [sorted(shard) for shard in shards]
+
+
+def get_shard(pattern, index, count, excludes=()):
+    """
+    Returns the labels of the shard ``index`` (starting at 1) of ``count``.
+
+    Recorded durations are used as weights if there are any for the
+    discovered labels. Otherwise the number of tests per module is used.
+
+    """
+    weights = discover_labels(pattern, excludes)
+    durations = load_durations()
+    if any(label in durations for label in weights):
+        # Modules without a recorded duration get the average duration
+        known = [durations[label] for label in weights if label in durations]
+        average = sum(known) / len(known)
+        weights = dict(
+            (label, durations.get(label, average)) for label in weights)
+    return partition(weights, count)[index - 1]
@@ -1,9 +1,59 @@
 """Utilities for the fabfile."""
+import os
+import pstats
+import re
+import subprocess
+import sys
+import threading
+import time
 from functools import wraps
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
-from fabric.api import env, run
-from fabric.colors import red
-from fabric.utils import abort
+from django.conf import settings
+
+from fabric.api import env, get, run
+from fabric.colors import green, red
+from fabric.utils import abort, puts
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+
+def get_profile_path(name):
+    """
+    Returns a new path for a profile stats file in ``PROFILE_DIR``.
+
+    :param name: A short name for what is profiled, e.g. ``migrate``.
+
+    """
+    profile_dir = getattr(settings, 'PROFILE_DIR', 'profiles')
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    filename = '{0}-{1}-{2}.prof'.format(
+        env.get('machine') or 'local', name, time.strftime('%Y%m%d-%H%M%S'))
+    return os.path.abspath(os.path.join(profile_dir, filename))
+
+
+def print_profile_stats(path):
+    """Prints the top ``PROFILE_TOP`` cumulative hotspots of a stats file."""
+    stats = pstats.Stats(path)
+    stats.sort_stats('cumulative').print_stats(
+        getattr(settings, 'PROFILE_TOP', 30))
+
+
+def profile_command(command, stats_file):
+    """
+    Wraps the ``manage.py`` call of the given command in cProfile.
+
+    :param stats_file: The file cProfile writes its stats to.
+
+    """
+    return re.sub(r'(python[\d.]*) manage\.py',
+                  r'\1 -m cProfile -o {0} manage.py'.format(stats_file),
+                  command, count=1)
 
 
 def require_server(fn):
@@ -26,12 +76,171 @@ def require_server(fn):
     return wrapper
 
 
-def run_workon(command):
+def run_local(command, warn_only=False):
+    """
+    Runs a local shell command quietly and returns its stripped output.
+
+    Unlike fabric's ``local`` inside ``settings(hide(...), warn_only=True)``
+    this doesn't modify ``env``, so it is safe to use in code that runs on
+    the threads of ``run_steps`` or ``run_parallel``.
+
+    :param warn_only: If ``True``, ``None`` is returned when the command
+      fails. Otherwise the task aborts with the command's error output.
+
+    """
+    process = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        if warn_only:
+            return None
+        abort(red('ERROR: {0} failed:\n{1}'.format(
+            command, stderr.decode('utf-8', 'replace'))))
+    return stdout.decode('utf-8').strip()
+
+
+def run_parallel(function, items, processes=None):
+    """
+    Calls the given function for each item on a pool of threads.
+
+    Exceptions (including the ``SystemExit`` raised by fabric's ``abort``) are
+    re-raised in the calling thread once all items have been processed.
+
+    :param function: A callable that takes one item.
+    :param items: An iterable of items.
+    :param processes: Number of worker threads. Defaults to the CPU count.
+    :returns: A list with the results in the order of the given items.
+
+    """
+    def call(item):
+        try:
+            return True, function(item)
+        except BaseException as exc:
+            return False, exc
+
+    pool = ThreadPool(int(processes or cpu_count()))
+    try:
+        results = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+    for succeeded, result in results:
+        if not succeeded:
+            raise result
+    return [result for succeeded, result in results]
+
+
+def run_steps(steps, parallel=True):
+    """
+    Runs steps that depend on each other and prints how long each step took.
+
+    A step is started as soon as all steps it depends on are done, so
+    independent steps run concurrently. Dependencies on steps that are not
+    part of ``steps`` are ignored.
+
+    If a step fails, the steps that are already running are awaited and the
+    error is re-raised.
+
+    :param steps: A list of ``(name, function, dependencies)`` tuples where
+      ``dependencies`` is a list of step names.
+    :param parallel: If ``False``, the steps run one after another in
+      dependency order. Otherwise stdin is detached while the steps run, so
+      they can't prompt for input.
+    :returns: A list of ``(name, seconds)`` tuples in order of completion.
+
+    """
+    if not parallel:
+        return _run_steps(steps, parallel)
+    # Every fabric ``run`` puts a terminal on stdin into cbreak mode and
+    # restores it afterwards. Overlapping calls restore in arbitrary order
+    # and can leave the terminal without echo, so concurrent steps get no
+    # terminal (and therefore no input).
+    stdin = sys.stdin
+    sys.stdin = open(os.devnull)
+    try:
+        return _run_steps(steps, parallel)
+    finally:
+        sys.stdin.close()
+        sys.stdin = stdin
+
+
+def _run_steps(steps, parallel):
+    """Runs the steps. See ``run_steps``."""
+    names = [name for name, function, dependencies in steps]
+    pending = [
+        (name, function, set(dependencies) & set(names))
+        for name, function, dependencies in steps]
+    finished = Queue()
+    done = set()
+    timings = []
+    running = 0
+    error = None
+    start = time.time()
+
+    def call(name, function):
+        step_start = time.time()
+        try:
+            function()
+        except BaseException as exc:
+            finished.put((name, time.time() - step_start, exc))
+        else:
+            finished.put((name, time.time() - step_start, None))
+
+    while (pending and error is None) or running:
+        ready = [step for step in pending if step[2] <= done]
+        if not parallel and running:
+            ready = []
+        if error is None:
+            for step in ready[:None if parallel else 1]:
+                pending.remove(step)
+                thread = threading.Thread(target=call, args=step[:2])
+                thread.daemon = True
+                thread.start()
+                running += 1
+        if not running:
+            abort(red('ERROR: Circular step dependencies: {0}'.format(
+                ', '.join(step[0] for step in pending))))
+        name, duration, exc = finished.get()
+        running -= 1
+        if exc is not None:
+            error = error or exc
+            continue
+        done.add(name)
+        timings.append((name, duration))
+
+    for name, duration in timings:
+        puts('{0:<20} {1:>8.1f}s'.format(name, duration))
+    puts(green('{0:<20} {1:>8.1f}s'.format('total', time.time() - start)))
+    if error is not None:
+        raise error
+    return timings
+
+
+def run_workon(command, cwd=None, profile=False):
     """
     Starts the virtualenv before running the given command.
 
     :param command: A string representing a shell command that should be
       executed.
+    :param cwd: A directory that the command should be executed in. Unlike
+      fabric's ``cd`` context manager this does not modify ``env``, so it can
+      be used from concurrently running steps.
+    :param profile: If ``True``, the ``manage.py`` call of the command runs
+      under cProfile. The stats file is downloaded into ``PROFILE_DIR`` and
+      the top cumulative hotspots are printed.
     """
     env.shell = "/bin/bash -l -i -c"
-    return run('workon {0} && {1}'.format(env.venv_name, command))
+    if profile:
+        local_path = get_profile_path(
+            command.split('manage.py', 1)[-1].split()[0])
+        remote_path = '/tmp/{0}'.format(os.path.basename(local_path))
+        command = profile_command(command, remote_path)
+    command = 'workon {0} && {1}'.format(env.venv_name, command)
+    if cwd:
+        command = 'cd {0} && {1}'.format(cwd, command)
+    result = run(command)
+    if profile:
+        get(remote_path, local_path)
+        run('rm -f {0}'.format(remote_path))
+        print_profile_stats(local_path)
+    return result
@@ -0,0 +1,71 @@
+"""Tests for the asset build tasks."""
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..fabfile.assets import _get_dependencies, _try_build_asset
+
+
+class GetDependenciesTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.files = {
+            'main.less': (
+                '@import "variables";\n@import (reference) "mixins.less";\n'
+                '@import "reset.css";'),
+            'reset.css': '@import "variables.less";',
+            'variables.less': '@color: red;',
+            'mixins.less': '@import "variables.less";',
+            'main.scss': "@import 'partials/base', 'missing';",
+            'partials/_base.scss': 'body { color: red; }',
+            'app.js': (
+                "var a = require('./lib');\nimport b from './lib/b';\n"
+                "import './style.css';"),
+            'style.css': 'body { color: red; }',
+            'lib/index.js': "import './b';",
+            'lib/b.js': "var jquery = require('jquery');",
+        }
+        for name, content in self.files.items():
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as asset_file:
+                asset_file.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get_dependencies(self, name):
+        return sorted(
+            os.path.relpath(path, self.root) for path in
+            _get_dependencies(os.path.join(self.root, name)))
+
+    def test_less(self):
+        self.assertEqual(
+            self.get_dependencies('main.less'),
+            ['main.less', 'mixins.less', 'reset.css', 'variables.less'])
+
+    def test_scss(self):
+        self.assertEqual(
+            self.get_dependencies('main.scss'),
+            ['main.scss', os.path.join('partials', '_base.scss')])
+
+    def test_js(self):
+        self.assertEqual(
+            self.get_dependencies('app.js'),
+            ['app.js', os.path.join('lib', 'b.js'),
+             os.path.join('lib', 'index.js'), 'style.css'])
+
+
+class TryBuildAssetTestCase(TestCase):
+    @override_settings(ASSET_COMPILERS={'.less': 'exit 1'})
+    def test_failed_build(self):
+        self.assertIsNone(_try_build_asset(('main.less', 'main.css')))
+
+    @override_settings(ASSET_COMPILERS={'.less': 'true'})
+    def test_build(self):
+        self.assertEqual(
+            _try_build_asset(('main.less', 'main.css')), 'main.css')
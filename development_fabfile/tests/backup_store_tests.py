@@ -0,0 +1,74 @@
+"""Tests for the backup store helpers."""
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from ..fabfile import backup_store
+
+
+class IterChunksTestCase(TestCase):
+    def test_chunks(self):
+        data = b'x' * (2 * backup_store.CHUNK_SIZE + 10)
+        chunks = list(backup_store.iter_chunks(io.BytesIO(data)))
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [backup_store.CHUNK_SIZE] * 2 + [10])
+        self.assertEqual(b''.join(chunks), data)
+
+
+class StoreTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = os.path.join(self.root, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as target:
+            target.write(content)
+
+    def read(self, path):
+        with open(os.path.join(self.root, path), 'rb') as source:
+            return source.read()
+
+    def test_file(self):
+        self.write('dump', os.urandom(backup_store.CHUNK_SIZE + 10))
+        name, new_chunks = backup_store.add_snapshot(
+            self.store, os.path.join(self.root, 'dump'), 'db')
+        self.assertEqual(new_chunks, 2)
+        backup_store.restore_snapshot(
+            self.store, name, os.path.join(self.root, 'restored'))
+        self.assertEqual(self.read('restored'), self.read('dump'))
+
+    def test_directory(self):
+        self.write('media/a.txt', b'a')
+        self.write('media/sub/b.txt', b'b')
+        self.write('media/empty.txt', b'')
+        path = os.path.join(self.root, 'media')
+        backup_store.add_snapshot(self.store, path, 'media')
+        # Only the changed file is stored again
+        self.write('media/sub/b.txt', b'c')
+        name, new_chunks = backup_store.add_snapshot(
+            self.store, path, 'media')
+        self.assertEqual(new_chunks, 1)
+        backup_store.restore_snapshot(
+            self.store, name, os.path.join(self.root, 'restored'))
+        self.assertEqual(self.read('restored/a.txt'), b'a')
+        self.assertEqual(self.read('restored/sub/b.txt'), b'c')
+        self.assertEqual(self.read('restored/empty.txt'), b'')
+
+    def test_retained_snapshots(self):
+        names = ['db-20161201-100000', 'db-20161201-120000',
+                 'db-20161202-100000', 'db-20161203-100000']
+        self.assertEqual(
+            backup_store.get_retained_snapshots(names, 1, 2),
+            set(['db-20161202-100000', 'db-20161203-100000']))
+        self.assertEqual(
+            backup_store.get_retained_snapshots(names, 0, 3),
+            set(names[1:]))
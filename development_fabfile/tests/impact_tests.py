@@ -0,0 +1,59 @@
+"""Tests for the test impact analysis helpers."""
+from django.test import TestCase
+
+from ..fabfile.impact import parse_diff, select_tests
+
+
+DIFF = """diff --git a/app/models.py b/app/models.py
+--- a/app/models.py
++++ b/app/models.py
+@@ -4 +4 @@ class Foo(object):
+-    LIMIT = 5
++    LIMIT = 6
+@@ -10,2 +10,3 @@ def bar():
+-    pass
+-    pass
++    return 1
+@@ -20,0 +22,2 @@ def baz():
++    x = 1
++    y = 2
+diff --git a/app/new.py b/app/new.py
+new file mode 100644
+--- /dev/null
++++ b/app/new.py
+@@ -0,0 +1 @@
++import os
+"""
+
+
+class ParseDiffTestCase(TestCase):
+    def test_hunks(self):
+        self.assertEqual(parse_diff(DIFF), {
+            'app/models.py': set([4, 10, 11, 20, 21]),
+            'app/new.py': None,
+        })
+
+
+class SelectTestsTestCase(TestCase):
+    files = {
+        'app/models.py': {
+            '4': [],
+            '10': ['app.tests.models_tests.FooTestCase.test_bar'],
+        },
+    }
+
+    def test_selects_tests_of_changed_lines(self):
+        self.assertEqual(
+            select_tests(self.files, {'app/models.py': set([10, 12])},
+                         '*_tests.py'),
+            ['app.tests.models_tests.FooTestCase.test_bar'])
+
+    def test_line_without_test_runs_all_tests(self):
+        self.assertIsNone(select_tests(
+            self.files, {'app/models.py': set([4, 10])}, '*_tests.py'))
+
+    def test_unknown_file_runs_all_tests(self):
+        self.assertIsNone(select_tests(
+            self.files, {'app/views.py': set([1])}, '*_tests.py'))
+        self.assertEqual(select_tests(
+            self.files, {'README.rst': None}, '*_tests.py', ['*.rst']), [])
@@ -0,0 +1,66 @@
+"""Tests for the HTTP load helpers."""
+import threading
+
+from django.test import TestCase
+
+from ..fabfile.loadtest import (
+    get_histogram, percentile, run_load, run_requests, summarize)
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(404 if self.path == '/missing/' else 200)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class LoadTestCase(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_requests(self):
+        latencies, errors = run_requests(
+            [self.base_url + '/', self.base_url + '/missing/'] * 3, 2)
+        self.assertEqual(len(latencies), 3)
+        self.assertEqual(errors, 3)
+
+    def test_run_load(self):
+        latencies, errors, elapsed = run_load([self.base_url + '/'], 2, 0.2)
+        self.assertTrue(latencies)
+        self.assertEqual(errors, 0)
+        result = summarize(latencies, errors, elapsed)
+        self.assertEqual(result['requests'], len(latencies))
+        self.assertEqual(
+            sum(count for bound, count in result['histogram']),
+            len(latencies))
+
+
+class StatisticsTestCase(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_histogram(self):
+        histogram = dict(get_histogram([0.005, 0.02, 0.02, 10]))
+        self.assertEqual(histogram[10], 1)
+        self.assertEqual(histogram[25], 2)
+        self.assertEqual(histogram[None], 1)
@@ -0,0 +1,55 @@
+"""Tests for the migration lock analysis."""
+from django.test import TestCase
+
+from ..fabfile.lock_analysis import classify, estimate_seconds
+
+
+SQL = """
+BEGIN;
+--
+-- Add field score to entry
+--
+ALTER TABLE "blog_entry" ADD COLUMN "score" integer DEFAULT 0 NOT NULL;
+ALTER TABLE "blog_entry" ALTER COLUMN "score" DROP DEFAULT;
+CREATE TABLE "blog_tag" ("id" serial NOT NULL PRIMARY KEY);
+CREATE INDEX "blog_entry_score_idx" ON "blog_entry" ("score");
+ALTER TABLE "blog_entry" ADD CONSTRAINT "blog_entry_tag_fk" FOREIGN KEY
+    ("tag_id") REFERENCES "blog_tag" ("id") DEFERRABLE INITIALLY DEFERRED;
+COMMIT;
+"""
+
+
+class ClassifyTestCase(TestCase):
+    def test_classify(self):
+        self.assertEqual(classify(SQL), [
+            ('blog_entry', 'add column with default', 'ACCESS EXCLUSIVE',
+             'rewrite'),
+            ('blog_entry', 'alter table', 'ACCESS EXCLUSIVE', 'instant'),
+            ('blog_entry', 'create index', 'SHARE', 'scan'),
+            ('blog_entry', 'add foreign key', 'SHARE ROW EXCLUSIVE', 'scan'),
+        ])
+
+    def test_fast_default(self):
+        sql = (
+            'ALTER TABLE "blog_entry" ADD COLUMN "score" integer DEFAULT 0'
+            ' NOT NULL;\n'
+            'ALTER TABLE "blog_entry" ADD COLUMN "slug" varchar(50)'
+            " DEFAULT 'x' NOT NULL;\n"
+            'ALTER TABLE "blog_entry" ADD COLUMN "created" timestamp'
+            ' DEFAULT now() NOT NULL;')
+        self.assertEqual(
+            [cost for table, description, lock, cost in classify(
+                sql, server_version=110005)],
+            ['instant', 'instant', 'rewrite'])
+        self.assertEqual(
+            [cost for table, description, lock, cost in classify(
+                sql, server_version=90624)],
+            ['rewrite', 'rewrite', 'rewrite'])
+
+
+class EstimateSecondsTestCase(TestCase):
+    def test_estimate(self):
+        size = 100 * 1024 * 1024
+        self.assertEqual(estimate_seconds('scan', size, 200, 50), 0.5)
+        self.assertEqual(estimate_seconds('rewrite', size, 200, 50), 2.0)
+        self.assertEqual(estimate_seconds('instant', size, 200, 50), 0.0)
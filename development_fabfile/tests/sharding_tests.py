@@ -0,0 +1,22 @@
+"""Tests for the test sharding helpers."""
+from django.test import TestCase
+
+from ..fabfile.sharding import partition
+
+
+class PartitionTestCase(TestCase):
+    def test_balances_weights(self):
+        weights = {'a': 5, 'b': 4, 'c': 3, 'd': 3, 'e': 1}
+        self.assertEqual(
+            partition(weights, 2), [['a', 'd'], ['b', 'c', 'e']])
+
+    def test_is_deterministic(self):
+        weights = dict(('label{0}'.format(i), i % 3) for i in range(20))
+        shards = partition(weights, 3)
+        self.assertEqual(partition(dict(weights), 3), shards)
+        self.assertEqual(
+            sorted(label for shard in shards for label in shard),
+            sorted(weights))
+
+    def test_more_shards_than_labels(self):
+        self.assertEqual(partition({'a': 1}, 3), [['a'], [], []])
@@ -0,0 +1,104 @@
+"""Tests for the fabfile utilities."""
+import sys
+import threading
+import time
+
+from django.test import TestCase
+
+from fabric.state import env
+
+from ..fabfile.utils import (
+    profile_command, run_local, run_parallel, run_steps)
+
+
+class ProfileCommandTestCase(TestCase):
+    def test_wraps_manage_py(self):
+        self.assertEqual(
+            profile_command('python3.5 manage.py migrate', '/tmp/x.prof'),
+            'python3.5 -m cProfile -o /tmp/x.prof manage.py migrate')
+
+
+class RunLocalTestCase(TestCase):
+    def test_returns_output(self):
+        self.assertEqual(run_local('echo foo'), 'foo')
+
+    def test_warn_only(self):
+        warn_only = env.warn_only
+        self.assertIsNone(run_local('exit 1', warn_only=True))
+        self.assertEqual(env.warn_only, warn_only)
+        with self.assertRaises(SystemExit):
+            run_local('exit 1')
+
+
+class RunParallelTestCase(TestCase):
+    def test_results_keep_order(self):
+        self.assertEqual(run_parallel(lambda x: x * 2, [3, 1, 2], 2),
+                         [6, 2, 4])
+
+    def test_reraises_system_exit(self):
+        def fail(item):
+            raise SystemExit(item)
+
+        with self.assertRaises(SystemExit):
+            run_parallel(fail, [1, 2])
+
+
+class RunStepsTestCase(TestCase):
+    def setUp(self):
+        self.log = []
+        self.lock = threading.Lock()
+
+    def step(self, name, duration=0):
+        def function():
+            with self.lock:
+                self.log.append(('start', name))
+            time.sleep(duration)
+            with self.lock:
+                self.log.append(('end', name))
+        return function
+
+    def test_dependencies(self):
+        timings = run_steps([
+            ('a', self.step('a'), []),
+            ('b', self.step('b', 0.1), ['a']),
+            ('c', self.step('c', 0.1), ['a', 'missing']),
+            ('d', self.step('d'), ['b', 'c']),
+        ])
+        self.assertEqual([name for name, duration in timings][0], 'a')
+        self.assertEqual([name for name, duration in timings][-1], 'd')
+        # b and c run concurrently
+        self.assertEqual(
+            set(self.log[2:4]), set([('start', 'b'), ('start', 'c')]))
+
+    def test_detaches_stdin(self):
+        stdin = sys.stdin
+        ttys = []
+        run_steps([('a', lambda: ttys.append(sys.stdin.isatty()), [])])
+        self.assertEqual(ttys, [False])
+        self.assertIs(sys.stdin, stdin)
+
+    def test_serial(self):
+        run_steps([
+            ('a', self.step('a'), []),
+            ('b', self.step('b'), []),
+        ], parallel=False)
+        self.assertEqual(self.log, [
+            ('start', 'a'), ('end', 'a'), ('start', 'b'), ('end', 'b')])
+
+    def test_failure(self):
+        def fail():
+            raise SystemExit(1)
+
+        with self.assertRaises(SystemExit):
+            run_steps([
+                ('a', fail, []),
+                ('b', self.step('b'), ['a']),
+            ])
+        self.assertEqual(self.log, [])
+
+    def test_circular_dependencies(self):
+        with self.assertRaises(SystemExit):
+            run_steps([
+                ('a', self.step('a'), ['b']),
+                ('b', self.step('b'), ['a']),
+            ])